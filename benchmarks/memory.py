@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Measure the memory held by the documents of a whole library once their
+# metadata has been loaded, as by browse, index or the daemon, against a
+# synthetic library (see synthetic.py), and fail if it exceeds the budget per
+# 10,000 documents. Memory is measured with tracemalloc in a fresh process,
+# after the catalog has been filled by a previous one.
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import synthetic
+
+
+CONFIG_NAME = '.libconf.yaml'
+
+# Megabytes that the documents of a library of 10,000 may hold, with all of
+# their metadata loaded.
+BUDGET_MB = 10
+
+
+def _load(manager):
+    ''' Load every document and all of its metadata. '''
+    docs = manager.all_docs()
+    for doc in docs:
+        doc.title, doc.authors, doc.year, doc.venue, doc.entrytype
+        doc.tags, doc.added_date, doc.accessed_date
+    return docs
+
+
+def run(library):
+    ''' Load a library in this process. Returns a dictionary of the number of
+        documents and the bytes held by them. '''
+    from librarianlib.management import LibraryManager
+
+    manager = LibraryManager([library], CONFIG_NAME)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    docs = _load(manager)
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    return {'docs': len(docs), 'bytes': held - before, 'peak': peak - before}
+
+
+def measure(library):
+    ''' Load a library in a fresh process. '''
+    result = subprocess.run(
+            [sys.executable, os.path.realpath(__file__), '--run', library],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=10000,
+                        help='Number of documents in the library.')
+    parser.add_argument('-d', '--dir',
+                        help='Directory to keep the generated library in, so '
+                             'it can be reused.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply the budget by this factor.')
+    # Used internally to run the measurement.
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        json.dump(run(args.run), sys.stdout)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = synthetic.cached(args.dir or tmp, args.size)
+        # The first run fills the catalog.
+        measure(library)
+        result = measure(library)
+
+    per_10k = result['bytes'] / result['docs'] * 10000 / 2**20
+    budget = BUDGET_MB * args.scale
+    print('{} documents hold {:.1f} MB (peak {:.1f} MB): {:.1f} MB per 10k '
+          'documents, budget {:.1f} MB.'.format(
+              result['docs'], result['bytes'] / 2**20, result['peak'] / 2**20,
+              per_10k, budget))
+    if per_10k > budget:
+        print('Memory regression.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
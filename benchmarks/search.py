@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# Measure how the main library operations scale, against synthetic libraries
+# of increasing size (see synthetic.py). Each operation is run in a fresh
+# process, both cold (with the library's caches and indexes removed) and warm
+# (with them left behind by a previous run), and its time, throughput, peak
+# RSS and I/O are recorded. Results are written as JSON, which can be compared
+# against the results of another commit with --compare.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import synthetic
+
+
+CONFIG_NAME = '.libconf.yaml'
+
+# Name of the directory of each library's caches and indexes, which is
+# removed for a cold run.
+CACHE_DIR_NAME = '.librarian'
+
+# Differences in time smaller than this, in seconds, are noise and never count
+# as a regression.
+MIN_DIFFERENCE = 0.01
+
+
+def _count(results):
+    return sum(1 for _ in results)
+
+
+def _text(manager):
+    return sum(len(doc.text()[0]) for doc in manager.all_docs())
+
+
+def _compile(manager):
+    with tempfile.TemporaryDirectory() as directory:
+        return manager.compile_bibtex(os.path.join(directory, 'bibtex.bib'))
+
+
+# Name => function of a LibraryManager, returning a number of results that
+# should be the same from one commit to the next.
+CASES = {
+    'all_docs': lambda m: len(m.all_docs()),
+    'get_tags': lambda m: len(m.get_tags()),
+    'search_key': lambda m: _count(m.search_docs(key='^smith')),
+    'search_tags': lambda m: _count(m.search_docs(tags='control')),
+    'search_metadata': lambda m: _count(m.search_docs(author='Smith',
+                                                      year='1990-2010')),
+    'search_query': lambda m: _count(m.search_docs(
+        query='(tag:robotics OR year:2000-2005) AND NOT type:misc')),
+    'search_sorted': lambda m: _count(m.search_docs(sort='year', limit=20)),
+    'search_recent': lambda m: _count(m.search_docs(sort='accessed',
+                                                    limit=20)),
+    'search_text': lambda m: _count(m.search_docs(text='legged locomotion')),
+    'text': _text,
+    'compile': _compile,
+}
+
+
+def _read_io():
+    ''' Read this process's I/O counters from /proc, or an empty dictionary
+        if they aren't available. syscr and syscw count read and write system
+        calls. '''
+    try:
+        with open('/proc/self/io') as f:
+            return {name: int(value) for name, value in
+                    (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def run_case(library, case):
+    ''' Run a single case against a library, in this process. Returns a
+        dictionary of measurements. '''
+    from librarianlib.management import LibraryManager
+
+    io_before = _read_io()
+    start = time.perf_counter()
+    manager = LibraryManager([library], CONFIG_NAME)
+    results = CASES[case](manager)
+    seconds = time.perf_counter() - start
+    io_after = _read_io()
+
+    measurements = {
+        'seconds': seconds,
+        'results': results,
+        # Kilobytes on Linux.
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    for name in ('syscr', 'syscw', 'rchar', 'wchar', 'read_bytes'):
+        if name in io_after:
+            measurements[name] = io_after[name] - io_before[name]
+    return measurements
+
+
+def _drop_caches():
+    ''' Drop the kernel's page cache, so that cold runs read from disk. Only
+        possible as root. '''
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3')
+
+
+def measure(library, case, cold, repeat, drop_caches):
+    ''' Run a case in fresh processes. Returns the measurements of the run
+        with the median time. '''
+    runs = []
+    for _ in range(repeat):
+        if cold:
+            shutil.rmtree(os.path.join(library, CACHE_DIR_NAME),
+                          ignore_errors=True)
+            if drop_caches:
+                _drop_caches()
+        result = subprocess.run(
+                [sys.executable, os.path.realpath(__file__), '--run', case,
+                 '--library', library],
+                stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        runs.append(json.loads(result.stdout))
+    runs.sort(key=lambda run: run['seconds'])
+    return runs[len(runs) // 2]
+
+
+def _commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(old, new, threshold):
+    ''' Print the ratio of the time of each measurement in new to that in
+        old. Returns True if any is slower by more than the threshold, or
+        has a different number of results. '''
+    old_results = {(r['size'], r['case'], r['mode']): r
+                   for r in old['results']}
+    regressed = False
+    print('{:>7} {:<16} {:<5} {:>10} {:>10} {:>7}'.format(
+        'size', 'case', 'mode', 'old s', 'new s', 'ratio'))
+    for r in new['results']:
+        o = old_results.get((r['size'], r['case'], r['mode']))
+        if o is None:
+            continue
+        ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+        flag = ''
+        if (ratio > 1 + threshold
+                and r['seconds'] - o['seconds'] > MIN_DIFFERENCE):
+            flag = '  slower'
+            regressed = True
+        if o['results'] != r['results']:
+            flag += '  results differ ({} vs {})'.format(o['results'],
+                                                         r['results'])
+            regressed = True
+        print('{:>7} {:<16} {:<5} {:>10.3f} {:>10.3f} {:>7.2f}{}'.format(
+            r['size'], r['case'], r['mode'], o['seconds'], r['seconds'],
+            ratio, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default='1000,10000',
+                        help='Comma-separated library sizes, e.g. '
+                             '1000,10000,100000.')
+    parser.add_argument('-c', '--cases', default=','.join(CASES),
+                        help='Comma-separated cases to run, of: {}.'.format(
+                            ', '.join(CASES)))
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Number of runs of each case and mode.')
+    parser.add_argument('-d', '--dir',
+                        help='Directory to keep the generated libraries in, '
+                             'so they can be reused. By default, they are '
+                             'generated in a temporary directory.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--text-words', type=int, default=300,
+                        help='Number of words of text per document.')
+    parser.add_argument('--drop-caches', action='store_true',
+                        help='Drop the page cache before cold runs (root '
+                             'only).')
+    parser.add_argument('-o', '--output', help='File to write results to.')
+    parser.add_argument('--compare',
+                        help='Results of another commit to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fraction by which a case must be slower to '
+                             'count as a regression.')
+    # Used internally to run a single case.
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--library', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        json.dump(run_case(args.library, args.run), sys.stdout)
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    cases = args.cases.split(',')
+    for case in cases:
+        if case not in CASES:
+            parser.error('Unknown case {}.'.format(case))
+
+    directory = args.dir or tempfile.mkdtemp()
+    results = []
+    try:
+        print('{:>7} {:<16} {:<5} {:>9} {:>10} {:>8} {:>9} {:>9}'.format(
+            'size', 'case', 'mode', 'seconds', 'docs/s', 'rss MB', 'reads',
+            'writes'))
+        for size in sizes:
+            library = synthetic.cached(directory, size, args.seed,
+                                       args.text_words)
+            for case in cases:
+                for mode in ('cold', 'warm'):
+                    run = measure(library, case, mode == 'cold', args.repeat,
+                                  args.drop_caches)
+                    run.update({'size': size, 'case': case, 'mode': mode,
+                                'docs_per_second': size / run['seconds']})
+                    results.append(run)
+                    print('{:>7} {:<16} {:<5} {:>9.3f} {:>10.0f} {:>8.1f} '
+                          '{:>9} {:>9}'.format(
+                              size, case, mode, run['seconds'],
+                              run['docs_per_second'], run['max_rss_kb'] / 1024,
+                              run.get('syscr', '-'), run.get('syscw', '-')))
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+    report = {
+        'commit': _commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'text_words': args.text_words,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print()
+        if compare(old, report, args.threshold):
+            print('Performance regression.')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Measure the cold-start import time of each lib subcommand using
+# python -X importtime, and fail if any exceeds its budget or imports one of
+# the heavy modules that only specific commands should need.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+LIBRARIAN = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))), 'librarian.py')
+
+# Modules that are slow to import and must only be loaded by the commands that
+# actually use them.
+HEAVY_MODULES = ['textract', 'bibtexparser', 'pyparsing', 'editor', 'yaml',
+                 'colorama']
+
+# (name, arguments, import time budget in ms). Arguments are chosen so that
+# the command runs to completion against an empty library.
+COMMANDS = [
+    ('complete', ['complete'], 20),
+    ('where', ['where'], 80),
+    ('tags', ['tags', '-n', '0'], 80),
+    ('browse', ['browse', '--key', '^$'], 80),
+    ('browse --text', ['browse', '--key', '^$', '--text', 'x'], 80),
+]
+
+
+def _make_library(path):
+    ''' Create an empty library to run the commands against. '''
+    os.makedirs(os.path.join(path, 'archive'))
+    with open(os.path.join(path, '.libconf.yaml'), 'w') as f:
+        f.write('library: {}\n'.format(path))
+
+
+def _parse_importtime(stderr):
+    ''' Parse the output of -X importtime. Returns a tuple (total, modules) of
+        the total import time in ms and the set of imported modules. '''
+    total = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip())
+        # Only top-level imports count towards the total, since nested ones
+        # are included in their parent's cumulative time.
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def measure(library, args, repeat):
+    ''' Run a command repeatedly. Returns a tuple (import_ms, modules) of the
+        median import time and the set of modules imported. '''
+    times = []
+    modules = set()
+    for _ in range(repeat):
+        result = subprocess.run(
+                [sys.executable, '-X', 'importtime', LIBRARIAN] + args,
+                cwd=library, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        total, modules = _parse_importtime(result.stderr)
+        times.append(total)
+    return statistics.median(times), modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='Number of runs per command.')
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help='Multiply every budget by this factor, e.g. on '
+                             'slow machines.')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as library:
+        _make_library(library)
+        print('{:<16} {:>10} {:>10}  {}'.format('command', 'import ms',
+                                                 'budget ms', 'heavy modules'))
+        for name, cmd_args, budget in COMMANDS:
+            budget *= args.scale
+            import_ms, modules = measure(library, cmd_args, args.repeat)
+            heavy = sorted(set(HEAVY_MODULES).intersection(modules))
+            print('{:<16} {:>10.1f} {:>10.1f}  {}'.format(
+                name, import_ms, budget, ', '.join(heavy) or '-'))
+            if import_ms > budget or heavy:
+                failed = True
+
+    if failed:
+        print('Startup time regression.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# Generate a synthetic library for benchmarking: every document gets a
+# realistic bibtex file, tags, added and accessed dates, and a text cache that
+# is up to date with a small placeholder PDF, so that nothing ever needs to be
+# extracted and no real PDFs are needed.
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from librarianlib.config import DATE_LOG_NAME
+from librarianlib.document import DATE_FORMAT, _hash_pdf, _stat_pdf
+
+
+SURNAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
+            'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez',
+            'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson',
+            'Martin', 'Lee', 'Thompson', 'White', 'Harris', 'Clark', 'Lewis',
+            'Robinson', 'Walker', 'Young', 'Allen', 'King', 'Wright', 'Scott',
+            'Nguyen', 'Hill', 'Green', 'Adams', 'Baker', 'Nelson', 'Carter',
+            'Mitchell', 'Roberts', 'Turner', 'Phillips', 'Campbell', 'Parker',
+            'Evans', 'Edwards', 'Collins', 'Stewart', 'Morris', 'Murphy',
+            'Cook', 'Rogers', 'Morgan', 'Peterson', 'Cooper', 'Reed', 'Bailey',
+            'Bell', 'Kelly', 'Howard', 'Ward', 'Cox', 'Richardson', 'Wood',
+            'Watson', 'Brooks', 'Bennett', 'Gray', 'James', 'Hughes', 'Price',
+            'Sanders', 'Myers', 'Long', 'Ross', 'Foster', 'Zhang', 'Wang',
+            'Li', 'Chen', 'Liu', 'Yang', 'Kim', 'Park', 'Tanaka', 'Suzuki',
+            'Sato', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Wagner',
+            'Becker', 'Dubois', 'Moreau', 'Laurent', 'Rossi', 'Russo',
+            'Ferrari', 'Kowalski', 'Nowak', 'Ivanov', 'Petrov', 'Novak',
+            r'M{\"u}ller', r'G{\"o}del', r'Erd{\H{o}}s', r'Sch{\"o}lkopf',
+            r'Fran{\c{c}}ois', r'Jos{\'e}']
+
+GIVEN_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer',
+               'Michael', 'Linda', 'David', 'Elizabeth', 'William', 'Barbara',
+               'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Wei', 'Yuki', 'Hans', 'Anna', 'Pierre', 'Marie', 'Giulia',
+               'Marco', 'Olga', 'Ivan', 'J.', 'A. B.', 'K.', 'R. J.']
+
+WORDS = ['robust', 'adaptive', 'optimal', 'learning', 'control', 'motion',
+         'planning', 'estimation', 'nonlinear', 'distributed', 'model',
+         'predictive', 'deep', 'neural', 'networks', 'reinforcement', 'policy',
+         'gradient', 'stochastic', 'convex', 'optimization', 'trajectory',
+         'manipulation', 'grasping', 'legged', 'locomotion', 'aerial',
+         'vehicles', 'multi-agent', 'systems', 'sensor', 'fusion', 'visual',
+         'odometry', 'localization', 'mapping', 'semantic', 'segmentation',
+         'graph', 'inference', 'bayesian', 'kernel', 'methods', 'sparse',
+         'representation', 'real-time', 'efficient', 'scalable', 'safe',
+         'verification', 'hybrid', 'dynamics', 'contact', 'uncertainty',
+         'approach', 'framework', 'analysis', 'theory', 'algorithms',
+         'survey', 'benchmark', 'dataset', 'continuous', 'discrete']
+
+JOURNALS = ['IEEE Transactions on Robotics', 'The International Journal of '
+            'Robotics Research', 'Journal of Machine Learning Research',
+            'Automatica', 'IEEE Transactions on Automatic Control',
+            'Artificial Intelligence', 'Nature', 'Science Robotics',
+            'Autonomous Robots', 'Robotics and Autonomous Systems']
+
+CONFERENCES = ['Proc. IEEE International Conference on Robotics and '
+               'Automation', 'Proc. IEEE/RSJ International Conference on '
+               'Intelligent Robots and Systems', 'Proc. Robotics: Science and '
+               'Systems', 'Advances in Neural Information Processing Systems',
+               'Proc. International Conference on Machine Learning',
+               'Proc. IEEE Conference on Decision and Control',
+               'Proc. Conference on Robot Learning',
+               'Proc. American Control Conference']
+
+PUBLISHERS = ['Springer', 'MIT Press', 'Cambridge University Press',
+              'Prentice Hall', 'Wiley']
+
+TAGS = ['robotics', 'control', 'ml', 'vision', 'planning', 'theory', 'rl',
+        'optimization', 'estimation', 'manipulation', 'locomotion', 'slam',
+        'survey', 'toread', 'important', 'thesis', 'teaching', 'mpc',
+        'safety', 'multiagent', 'aerial', 'legged', 'grasping', 'dynamics',
+        'learning', 'probabilistic', 'graphs', 'kernels', 'datasets',
+        'benchmarks', 'hri', 'perception', 'sensors', 'simulation',
+        'hardware', 'software', 'classic', 'recent', 'reviewed', 'cited']
+
+# Entry type => relative frequency.
+ENTRYTYPES = [('article', 40), ('inproceedings', 45), ('book', 4),
+              ('techreport', 3), ('phdthesis', 3), ('misc', 5)]
+
+PDF_TEMPLATE = '%PDF-1.4\n% Synthetic document {}\n%%EOF\n'
+
+
+def _title(rng):
+    words = rng.sample(WORDS, rng.randint(4, 11))
+    return ' '.join(words).capitalize()
+
+
+def _author(rng):
+    return '{}, {}'.format(rng.choice(SURNAMES), rng.choice(GIVEN_NAMES))
+
+
+def _key(author, year, title, keys):
+    surname = ''.join(c for c in author.split(',')[0] if c.isalpha()).lower()
+    key = '{}{}{}'.format(surname, year, title.split()[0].lower())
+    if key in keys:
+        key = '{}{}'.format(key, len(keys))
+    keys.add(key)
+    return key
+
+
+def _bibtex(rng, entrytype, key, authors, title, year):
+    fields = [('author', ' and '.join(authors)), ('title', title),
+              ('year', str(year))]
+    if entrytype == 'article':
+        fields += [('journal', rng.choice(JOURNALS)),
+                   ('volume', str(rng.randint(1, 60))),
+                   ('number', str(rng.randint(1, 12))),
+                   ('pages', '{}--{}'.format(rng.randint(1, 900),
+                                             rng.randint(901, 1200)))]
+    elif entrytype == 'inproceedings':
+        fields += [('booktitle', rng.choice(CONFERENCES)),
+                   ('pages', '{}--{}'.format(rng.randint(1, 900),
+                                             rng.randint(901, 1200))),
+                   ('month', rng.choice(['jan', 'may', 'jun', 'sep', 'dec']))]
+    elif entrytype == 'book':
+        fields += [('publisher', rng.choice(PUBLISHERS))]
+    elif entrytype == 'techreport':
+        fields += [('institution', 'University of {}'.format(
+                       rng.choice(SURNAMES)))]
+    elif entrytype == 'phdthesis':
+        fields += [('school', 'University of {}'.format(
+                       rng.choice(SURNAMES)))]
+    else:
+        fields += [('howpublished', r'\url{{https://arxiv.org/abs/{}.{:05d}}}'
+                                    .format(rng.randint(1000, 2500),
+                                            rng.randint(0, 99999)))]
+    if rng.random() < 0.3:
+        fields.append(('doi', '10.{}/{}'.format(rng.randint(1000, 9999),
+                                                 rng.randint(10**6, 10**7))))
+    body = ',\n'.join('  {} = {{{}}}'.format(name, value)
+                      for name, value in fields)
+    return '@{}{{{},\n{}\n}}\n'.format(entrytype, key, body)
+
+
+def _text(rng, title, words):
+    ''' Fake text of a document: its title followed by random words. '''
+    body = [rng.choice(WORDS) for _ in range(words)]
+    lines = [' '.join(body[i:i + 12]) for i in range(0, len(body), 12)]
+    return '{}\n\n{}\n'.format(title, '\n'.join(lines))
+
+
+def _write(path, contents):
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def generate(path, count, seed=0, text_words=300):
+    ''' Generate a library of count documents at path, which must not
+        exist. Returns the path of its configuration file. '''
+    rng = random.Random(seed)
+    archive_path = os.path.join(path, 'archive')
+    os.makedirs(archive_path)
+    for name in ('shelves', 'bookmarks'):
+        os.makedirs(os.path.join(path, name))
+    config_path = os.path.join(path, '.libconf.yaml')
+    _write(config_path, 'library: {}\n'.format(path))
+
+    entrytypes, weights = zip(*ENTRYTYPES)
+    # Tags follow a Zipf-like distribution, as in real libraries.
+    tag_weights = [1 / (rank + 1) for rank in range(len(TAGS))]
+    today = datetime.date(2024, 1, 1)
+    keys = set()
+    date_log = []
+    for i in range(count):
+        entrytype = rng.choices(entrytypes, weights)[0]
+        authors = [_author(rng) for _ in range(rng.randint(1, 6))]
+        year = rng.randint(1960, 2023)
+        title = _title(rng)
+        key = _key(authors[0], year, title, keys)
+
+        key_path = os.path.join(archive_path, key)
+        metadata_path = os.path.join(key_path, '.metadata')
+        os.makedirs(metadata_path)
+        pdf_path = os.path.join(key_path, key + '.pdf')
+        _write(pdf_path, PDF_TEMPLATE.format(key))
+        _write(os.path.join(key_path, key + '.bib'),
+               _bibtex(rng, entrytype, key, authors, title, year))
+
+        tags = set(rng.choices(TAGS, tag_weights, k=rng.randint(0, 4)))
+        if tags:
+            _write(os.path.join(key_path, 'tags.txt'), '\n'.join(sorted(tags)))
+
+        added = today - datetime.timedelta(days=rng.randint(0, 3650))
+        date_log.append('{} added {}\n'.format(added.strftime(DATE_FORMAT),
+                                               key))
+        if rng.random() < 0.6:
+            accessed = added + datetime.timedelta(
+                    days=rng.randint(0, (today - added).days))
+            date_log.append('{} accessed {}\n'.format(
+                accessed.strftime(DATE_FORMAT), key))
+
+        # An up-to-date text cache, as left behind by lib extract.
+        _write(os.path.join(metadata_path, 'text.txt'),
+               _text(rng, title, text_words))
+        _write(os.path.join(metadata_path, 'hash.b2'), _hash_pdf(pdf_path))
+        _write(os.path.join(metadata_path, 'stat.txt'), _stat_pdf(pdf_path))
+    _write(os.path.join(path, DATE_LOG_NAME), ''.join(date_log))
+    return config_path
+
+
+def cached(directory, count, seed=0, text_words=300):
+    ''' Return the path of a library generated in a directory, generating it
+        unless a previous call already has, so it can be reused. '''
+    path = os.path.join(directory, 'library-{}-{}-{}'.format(count, seed,
+                                                             text_words))
+    done_path = os.path.join(path, '.generated')
+    if not os.path.exists(done_path):
+        shutil.rmtree(path, ignore_errors=True)
+        print('Generating {} documents...'.format(count), file=sys.stderr)
+        generate(path, count, seed, text_words)
+        open(done_path, 'w').close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='Directory to create the library in.')
+    parser.add_argument('-n', '--count', type=int, default=1000,
+                        help='Number of documents.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the random number generator.')
+    parser.add_argument('--text-words', type=int, default=300,
+                        help='Number of words of text per document.')
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        print('{} already exists.'.format(args.path))
+        return 1
+    generate(args.path, args.count, args.seed, args.text_words)
+    print('Generated {} documents in {}.'.format(args.count, args.path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
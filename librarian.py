@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 
-import argparse
 import os
 import sys
 
-from librarianlib.management import LibraryManager
-from librarianlib.command_interface import LibraryCommandInterface
-from librarianlib.exceptions import LibraryException
+from librarianlib import completion
 
 
 CONFIG_FILE_NAME = '.libconf.yaml'
@@ -14,7 +11,33 @@ CONFIG_SEARCH_DIRS = [os.path.dirname(os.path.realpath(__file__)), os.getcwd(),
                       os.path.expanduser('~')]
 
 
-def parse_args(cmd_interface):
+def add_filter_arguments(parser, text_option='--text'):
+    ''' Add the options for filtering documents to a parser. The option to
+        filter by text can be renamed, for commands that already have a
+        --text option. '''
+    parser.add_argument('--key', help='Filter by key.')
+    parser.add_argument('--author', help='Filter by author.')
+    parser.add_argument('--title', help='Filter by title.')
+    parser.add_argument('--year', help='Filter by publication year.')
+    parser.add_argument('--venue', help='Filter by publication venue.')
+    parser.add_argument('--type', help='Filter by document type.')
+    parser.add_argument(text_option, dest='text_pattern',
+                        help='Filter by document text.')
+    parser.add_argument('--tags', help='Filter by document tags.')
+    parser.add_argument('--opened', type=int, metavar='DAYS',
+                        help='Only documents opened within the last DAYS '
+                             'days.')
+    parser.add_argument('-q', '--query',
+                        help='Filter by a query combining field:pattern terms '
+                             'with AND, OR, NOT and parentheses, e.g. '
+                             '\'author:smith (year:2015-2020 OR tag:robotics) '
+                             'NOT venue:arxiv\'.')
+
+
+def parse_args():
+    # Imported here so that completion doesn't pay for it.
+    import argparse
+
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(help='Command.')
 
@@ -24,46 +47,56 @@ def parse_args(cmd_interface):
             aliases=['ln'],
             help='Create a symlink to a document in the archive.')
     link_parser.add_argument('-f', '--fix', action='store_true',
-                             help='Fix a broken symlink into the library.')
-    link_parser.add_argument('key', help='Key for document to symlink.')
+                             help='Fix a broken symlink into the library, or '
+                                  'all those in a directory. Without one, '
+                                  'fix every link created by lib.')
+    link_parser.add_argument('-r', '--recursive', action='store_true',
+                             help='With --fix, fix links in subdirectories '
+                                  'too. Without a directory, search the '
+                                  'shelves and bookmarks.')
+    link_parser.add_argument('key', nargs='?',
+                             help='Key for document to symlink, or the link '
+                                  'or directory to fix.')
     link_parser.add_argument('name', nargs='?', help='Name for the link.')
-    link_parser.set_defaults(func=cmd_interface.link)
+    link_parser.set_defaults(func='link')
 
     # Browse parser.
     browse_parser = subparsers.add_parser('browse', aliases=['search', 'grep'],
                                           help='Filter documents.')
-    browse_parser.add_argument('--key', help='Filter by key.')
-    browse_parser.add_argument('--author', help='Filter by author.')
-    browse_parser.add_argument('--title', help='Filter by title.')
-    browse_parser.add_argument('--year', help='Filter by publication year.')
-    browse_parser.add_argument('--venue', help='Filter by publication venue.')
-    browse_parser.add_argument('--type', help='Filter by document type.')
-    browse_parser.add_argument('--text', help='Filter by document text.')
-    browse_parser.add_argument('--tags', help='Filter by document tags.')
+    add_filter_arguments(browse_parser)
 
     browse_parser.add_argument('-s', '--sort',
                                choices=['key', 'title', 'year', 'added',
-                                        'recent', 'matches'],
-                               help='Sort the results.')
+                                        'accessed', 'recent', 'matches'],
+                               help='Sort the results. recent is the same as '
+                                    'accessed, the date last opened.')
     browse_parser.add_argument('-n', '--number', type=int,
                                help='Limit the number of results.')
     browse_parser.add_argument('-v', '--verbose', action='count',
                                help='Specify verbosity.')
     browse_parser.add_argument('-r', '--reverse', action='store_true',
                                help='Reverse sorting order.')
-    browse_parser.set_defaults(func=cmd_interface.browse)
+    browse_parser.set_defaults(func='browse')
 
     # Add parser.
     add_parser = subparsers.add_parser(
             'add',
             help='Add a new document to the library.')
-    add_parser.add_argument('pdf', help='PDF file.')
-    add_parser.add_argument('bibtex', help='Associated bibtex file.')
+    add_parser.add_argument('pdf', nargs='?', help='PDF file.')
+    add_parser.add_argument('bibtex', nargs='?',
+                            help='Associated bibtex file.')
+    add_parser.add_argument('--batch', metavar='DIR',
+                            help='Add every PDF and bibtex pair in a '
+                                 'directory.')
+    add_parser.add_argument('-j', '--threads', type=int,
+                            help='Number of threads used by --batch.')
     add_parser.add_argument('-d', '--delete', action='store_true',
                             help='Delete files after archiving.')
+    add_parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Add PDFs already in the library anyway.')
     add_parser.add_argument('-t', '--tag', nargs='+',
                             help='Apply one or more tags to the document.')
-    add_parser.set_defaults(func=cmd_interface.add)
+    add_parser.set_defaults(func='add')
 
     # Open parser.
     open_parser = subparsers.add_parser('open',
@@ -73,7 +106,7 @@ def parse_args(cmd_interface):
                              help='Open bibtex file.')
     open_parser.add_argument('-t', '--tag', action='store_true',
                              help='Open tag file.')
-    open_parser.set_defaults(func=cmd_interface.open)
+    open_parser.set_defaults(func='open')
 
     # Compile subcommand.
     compile_parser = subparsers.add_parser('compile')
@@ -81,12 +114,52 @@ def parse_args(cmd_interface):
                                 help='Compile bibtex files.')
     compile_parser.add_argument('-t', '--text', action='store_true',
                                 help='Compile PDF documents.')
-    compile_parser.set_defaults(func=cmd_interface.compile)
+    compile_parser.add_argument('-o', '--output', default='bibtex.bib',
+                                help='Bibtex file to compile to.')
+    compile_parser.add_argument('-i', '--incremental', action='store_true',
+                                help='Only rewrite the bibtex file if '
+                                     'something has changed.')
+    compile_parser.add_argument('-d', '--directory', default='text',
+                                help='Directory to compile PDFs to.')
+    compile_parser.add_argument('--link', choices=['hard', 'symbolic'],
+                                help='Link to the PDFs instead of copying '
+                                     'them.')
+    compile_parser.add_argument('-j', '--threads', type=int,
+                                help='Number of threads used to copy PDFs.')
+    add_filter_arguments(compile_parser, text_option='--contains')
+    compile_parser.set_defaults(func='compile')
+
+    # Extract subcommand.
+    extract_parser = subparsers.add_parser(
+            'extract',
+            help='Extract the text of documents with stale text caches.')
+    extract_parser.add_argument('-j', '--processes', type=int,
+                                help='Number of extraction processes.')
+    extract_parser.add_argument('--verify', action='store_true',
+                                help='Hash every PDF to check for changes.')
+    extract_parser.add_argument('--retry-failed', action='store_true',
+                                help='Retry documents that failed before.')
+    extract_parser.set_defaults(func='extract')
+
+    # Dedupe subcommand.
+    dedupe_parser = subparsers.add_parser(
+            'dedupe',
+            help='Report documents that are likely to be duplicates.')
+    dedupe_parser.set_defaults(func='dedupe')
+
+    # Index subcommand.
+    index_parser = subparsers.add_parser(
+            'index',
+            help='Generate an HTML file listing all documents.')
+    index_parser.add_argument('-o', '--output',
+                              help='Directory to write the index to. '
+                                   'Defaults to index/ in the library.')
+    index_parser.set_defaults(func='index')
 
     # Where subcommand.
     where_parser = subparsers.add_parser('where',
                                          help='Print library archive directory.')
-    where_parser.set_defaults(func=cmd_interface.where)
+    where_parser.set_defaults(func='where')
 
     # Bookmark subcommand.
     bookmark_parser = subparsers.add_parser('bookmark', aliases=['bm'],
@@ -94,15 +167,22 @@ def parse_args(cmd_interface):
     bookmark_parser.add_argument('key', help='Key for document to bookmark.')
     bookmark_parser.add_argument('name', nargs='?',
                                  help='Name for the bookmark.')
-    bookmark_parser.set_defaults(func=cmd_interface.bookmark)
+    bookmark_parser.set_defaults(func='bookmark')
 
     # rekey subcommand.
     rekey_parser = subparsers.add_parser(
             'rekey', aliases=['rename'],
             help='Change the name of a key.')
-    rekey_parser.add_argument('key', help='The key to change.')
-    rekey_parser.add_argument('new-key', nargs='?', help='New key name.')
-    rekey_parser.set_defaults(func=cmd_interface.rekey)
+    rekey_parser.add_argument('key', nargs='?', help='The key to change.')
+    rekey_parser.add_argument('new-key', nargs='?',
+                              help='New key name. By default, the key in the '
+                                   'bibtex file is used.')
+    rekey_parser.add_argument('--from-bibtex', action='store_true',
+                              help='Use the key in the bibtex file.')
+    rekey_parser.add_argument('-a', '--all', action='store_true',
+                              help='Rekey every document whose bibtex file '
+                                   'has a different key, as one batch.')
+    rekey_parser.set_defaults(func='rekey')
 
     # tag subcommand.
     tag_parser = subparsers.add_parser('tag', help='Add tags to documents.')
@@ -110,24 +190,35 @@ def parse_args(cmd_interface):
                             help='Keys to add the tags to.')
     tag_parser.add_argument('-t', '--tag', '--tags', nargs='+', required=True,
                             help='Tags to apply.')
-    tag_parser.set_defaults(func=cmd_interface.add_tags)
+    tag_parser.set_defaults(func='add_tags')
 
     # tags subcommand.
     tags_parser = subparsers.add_parser('tags', help='List all tags.')
     tags_parser.add_argument('-n', '--number', type=int,
                              help='Limit the number of results.')
     tags_parser.add_argument('--rename', nargs=2, help='Rename a key.')
-    tags_parser.set_defaults(func=cmd_interface.list_tags)
+    tags_parser.set_defaults(func='list_tags')
+
+    # daemon subcommand.
+    daemon_parser = subparsers.add_parser(
+            'daemon',
+            help='Keep the library in memory to answer queries quickly.')
+    daemon_parser.add_argument('--stop', action='store_true',
+                               help='Stop the running daemon.')
+    daemon_parser.set_defaults(func='daemon')
 
     # Hidden subcommand for generating completion list of keys.
     complete_parser = subparsers.add_parser('complete', help=argparse.SUPPRESS)
-    complete_parser.set_defaults(func=cmd_interface.complete)
+    complete_group = complete_parser.add_mutually_exclusive_group()
+    complete_group.add_argument('--tags', action='store_true')
+    complete_group.add_argument('--authors', action='store_true')
+    complete_parser.set_defaults(func='complete')
 
-    # Every subparser has an associated function, that we extract here.
+    # Every subparser has an associated command, that we extract here.
     args = parser.parse_args()
     args = vars(args)
-    func = args.pop('func')
-    return args, func
+    command = args.pop('func')
+    return args, command
 
 
 def main():
@@ -135,6 +226,26 @@ def main():
         print('Usage: lib command [opts] [args]. Try --help.')
         return 1
 
+    # Completion runs on every TAB press, so it takes a fast path that avoids
+    # importing the rest of the library.
+    if sys.argv[1] == 'complete':
+        return completion.main(CONFIG_SEARCH_DIRS, CONFIG_FILE_NAME,
+                               sys.argv[2:])
+
+    from librarianlib import daemon_client
+
+    args, command = parse_args()
+
+    # If the daemon is running, it answers queries from memory.
+    status = daemon_client.run(CONFIG_SEARCH_DIRS, CONFIG_FILE_NAME, command,
+                               args)
+    if status is not None:
+        return status
+
+    from librarianlib.management import LibraryManager
+    from librarianlib.command_interface import LibraryCommandInterface
+    from librarianlib.exceptions import LibraryException
+
     # Load the library manager and command interface.
     try:
         manager = LibraryManager(CONFIG_SEARCH_DIRS, CONFIG_FILE_NAME)
@@ -143,18 +254,18 @@ def main():
         print(e.message)
         return 1
 
-    args, func = parse_args(cmd_interface)
+    func = getattr(cmd_interface, command)
 
     try:
         # Handle ctrl-c nicely.
         try:
-            func(**args)
+            status = func(**args)
         except KeyboardInterrupt:
             return 1
     except LibraryException as e:
         print(e.message)
         return 1
-    return 0
+    return status or 0
 
 
 if __name__ == '__main__':
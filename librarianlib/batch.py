@@ -0,0 +1,152 @@
+import os
+
+from .document import _parse_bibtex, _read_bibtex
+from .exceptions import LibraryException
+from .hashindex import hash_pdfs
+
+
+class PendingDocument(object):
+    ''' A PDF and bibtex file waiting to be added to the archive. The bibtex
+        has already been parsed, so that it doesn't need to be again. '''
+    def __init__(self, pdf_path, bib_path, bibtex, bibtex_str):
+        self.key = bibtex['ID']
+        self.pdf_path = pdf_path
+        self.bib_path = bib_path
+        self.bibtex = bibtex
+        self.bibtex_str = bibtex_str
+        self.pdf_hash = None
+
+
+def read_bib(bib_path):
+    ''' Parse a bibtex file to be added to the archive, checking that it has
+        a single entry with all the fields a document needs.
+        Returns a tuple (bibtex, text) of the entry and the raw contents. '''
+    entries, text = _read_bibtex(bib_path)
+    if len(entries) != 1:
+        msg = '{} must contain exactly one entry, but has {}.'.format(
+                bib_path, len(entries))
+        raise LibraryException(msg)
+    _parse_bibtex(entries[0])
+    return entries[0], text
+
+
+def _find_files(directory):
+    ''' Find the bibtex and PDF files in a directory tree. Returns a tuple
+        (bib_paths, pdf_paths), each in a stable order. '''
+    bib_paths = []
+    pdf_paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            ext = os.path.splitext(name)[1].lower()
+            if ext == '.bib':
+                bib_paths.append(os.path.join(root, name))
+            elif ext == '.pdf':
+                pdf_paths.append(os.path.join(root, name))
+    return bib_paths, pdf_paths
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _match_pdf(bib_path, key, pdfs_by_stem):
+    ''' Find the PDF to pair with a bibtex file: the one named after its key
+        or, failing that, the one with the same name as the bibtex file. Of
+        several candidates, one in the same directory as the bibtex file wins.
+        Returns a list of the equally good candidates. '''
+    bib_dir = os.path.dirname(bib_path)
+    for stem in (key, _stem(bib_path)):
+        candidates = pdfs_by_stem.get(stem, [])
+        if len(candidates) > 1:
+            nearby = [path for path in candidates
+                      if os.path.dirname(path) == bib_dir]
+            candidates = nearby if nearby else candidates
+        if candidates:
+            return candidates
+    return []
+
+
+def find_pairs(directory):
+    ''' Find the PDF and bibtex files in a directory tree and pair them up,
+        parsing each bibtex file once.
+        Returns a tuple (pending, problems) of the list of PendingDocuments
+        and a list of messages describing the files that couldn't be read or
+        paired. '''
+    if not os.path.isdir(directory):
+        raise LibraryException('{} is not a directory.'.format(directory))
+    bib_paths, pdf_paths = _find_files(directory)
+    pdfs_by_stem = {}
+    for pdf_path in pdf_paths:
+        pdfs_by_stem.setdefault(_stem(pdf_path), []).append(pdf_path)
+
+    pending = []
+    problems = []
+    paired = {}
+    for bib_path in bib_paths:
+        try:
+            bibtex, text = read_bib(bib_path)
+        except LibraryException as e:
+            problems.append(e.message)
+            continue
+
+        candidates = _match_pdf(bib_path, bibtex['ID'], pdfs_by_stem)
+        if not candidates:
+            problems.append('No PDF found for {} (key {}).'.format(
+                bib_path, bibtex['ID']))
+        elif len(candidates) > 1:
+            problems.append('More than one PDF matches {}: {}.'.format(
+                bib_path, ', '.join(candidates)))
+        elif candidates[0] in paired:
+            problems.append('{} matches both {} and {}.'.format(
+                candidates[0], paired[candidates[0]], bib_path))
+        else:
+            paired[candidates[0]] = bib_path
+            pending.append(PendingDocument(candidates[0], bib_path, bibtex,
+                                           text))
+
+    for pdf_path in pdf_paths:
+        if pdf_path not in paired:
+            problems.append('No bibtex file found for {}.'.format(pdf_path))
+    return pending, problems
+
+
+def check_pending(pending, has_key, archive_hashes, threads=None):
+    ''' Check that a batch of documents can be added to the archive: each key
+        must be new and used only once, and no PDF may be the same as another
+        in the batch or one already in the archive. The hash of each PDF is
+        stored in its PendingDocument as pdf_hash.
+        Params:
+            pending - List of PendingDocuments.
+            has_key - Function returning True if a key is in the archive.
+            archive_hashes - Dictionary mapping the hash of each PDF in the
+                             archive to the list of keys that have it.
+            threads - Number of threads used to hash the PDFs.
+        Returns:
+            A tuple (problems, duplicates) of lists of messages describing the
+            key collisions and the duplicate PDFs found. '''
+    problems = []
+    bib_paths_by_key = {}
+    for item in pending:
+        bib_paths_by_key.setdefault(item.key, []).append(item.bib_path)
+    for key, bib_paths in bib_paths_by_key.items():
+        if has_key(key):
+            problems.append('Archive already contains key {}.'.format(key))
+        if len(bib_paths) > 1:
+            problems.append('Key {} is used by more than one file: {}.'.format(
+                key, ', '.join(bib_paths)))
+
+    duplicates = []
+    seen = {}
+    hashes = hash_pdfs([item.pdf_path for item in pending], threads)
+    for item, pdf_hash in zip(pending, hashes):
+        item.pdf_hash = pdf_hash
+        if pdf_hash in archive_hashes:
+            duplicates.append('{} is already in the archive as {}.'.format(
+                item.pdf_path, ', '.join(archive_hashes[pdf_hash])))
+        elif pdf_hash in seen:
+            duplicates.append('{} is a duplicate of {}.'.format(
+                item.pdf_path, seen[pdf_hash]))
+        else:
+            seen[pdf_hash] = item.pdf_path
+    return problems, duplicates
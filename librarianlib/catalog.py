@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+
+from . import completion
+from .document import DocumentPaths, ArchivalDocument
+from .exceptions import LibraryException
+from .fileops import file_stamp
+
+
+# Bump this whenever the layout of the documents table changes; an outdated
+# catalog is simply discarded and rebuilt.
+CATALOG_VERSION = 3
+
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    title TEXT,
+    authors TEXT,
+    year TEXT,
+    venue TEXT,
+    entrytype TEXT,
+    tags TEXT
+)
+'''
+
+# The bibtex itself isn't cataloged: it is rarely needed once its fields have
+# been parsed, and is read from the document's file when it is. Nor are the
+# dates, which are all in the date log.
+RECORD_FIELDS = ['title', 'authors', 'year', 'venue', 'entrytype', 'tags']
+
+# Fields stored as JSON rather than plain text.
+JSON_FIELDS = ['authors', 'tags']
+
+
+def document_stamp(paths):
+    ''' Stamp of all the files a catalog record is derived from. If any of them
+        change, the record is stale. '''
+    stamp = []
+    for path in (paths.bib_path, paths.tag_path):
+        stamp.extend(file_stamp(path))
+    return json.dumps(stamp)
+
+
+class Catalog(object):
+    ''' Persistent cache of the parsed metadata of every document in the
+        archive, stored as an SQLite database at the root of the library. '''
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        ''' Open the catalog database, (re)creating it if it is missing or
+            out of date. Returns None if the catalog cannot be used, e.g. if
+            the library is read-only. '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != CATALOG_VERSION:
+                with conn:
+                    conn.execute('DROP TABLE IF EXISTS documents')
+                    conn.execute('PRAGMA user_version = {}'.format(
+                        CATALOG_VERSION))
+            conn.execute(CATALOG_SCHEMA)
+        except (OSError, sqlite3.Error):
+            return None
+        return conn
+
+    def _load_rows(self, conn):
+        ''' Read every row of the catalog in a single query. Returns a
+            dictionary mapping key to the raw row; rows are only decoded once
+            they are known to be needed. '''
+        if conn is None:
+            return {}
+        try:
+            cursor = conn.execute('SELECT key, stamp, {} FROM documents'.format(
+                ', '.join(RECORD_FIELDS)))
+            return {row[0]: row for row in cursor}
+        except sqlite3.Error:
+            return {}
+
+    def fill(self, docs, prune_keys=None):
+        ''' Fill in the metadata of each document from the catalog if its
+            record is up to date; otherwise it will be parsed from disk when
+            needed. Documents are yielded as they are processed, and records
+            for those that were stale are updated once the documents have all
+            been consumed. If prune_keys is given, it must contain every key
+            in the archive, and records for any other keys are removed. '''
+        conn = self._connect()
+        rows = self._load_rows(conn)
+
+        stale = []
+        try:
+            for doc in docs:
+                stamp = document_stamp(doc.paths)
+                row = rows.get(doc.key)
+                if row is not None and row[1] == stamp:
+                    record = dict(zip(RECORD_FIELDS, row[2:]))
+                    for field in JSON_FIELDS:
+                        record[field] = json.loads(record[field])
+                    doc.load_record(record)
+                else:
+                    stale.append((stamp, doc))
+                yield doc
+        finally:
+            if conn is not None:
+                removed = []
+                if prune_keys is not None:
+                    removed = set(rows.keys()).difference(prune_keys)
+                self._update(conn, stale, removed)
+
+    def documents(self, archive_path, keys):
+        ''' Return documents for every key in the archive. Documents whose
+            files have not changed since they were cataloged are built from the
+            catalog; the rest are parsed from disk and the catalog is
+            updated. '''
+        docs = (ArchivalDocument(key, DocumentPaths(archive_path, key))
+                for key in keys)
+        return list(self.fill(docs, prune_keys=keys))
+
+    def rename_keys(self, archive_path, renames):
+        ''' Move the records of rekeyed documents, given as (old_key, new_key)
+            pairs, to their new keys, so that they needn't be parsed again.
+            None of the cataloged metadata depends on the key. '''
+        conn = self._connect()
+        if conn is None:
+            return
+        select = 'SELECT {} FROM documents WHERE key = ?'.format(
+                ', '.join(RECORD_FIELDS))
+        insert = 'INSERT OR REPLACE INTO documents VALUES ({})'.format(
+                ', '.join('?' * (len(RECORD_FIELDS) + 2)))
+        try:
+            with conn:
+                for old_key, new_key in renames:
+                    row = conn.execute(select, (old_key,)).fetchone()
+                    conn.execute('DELETE FROM documents WHERE key = ?',
+                                 (old_key,))
+                    if row is None:
+                        continue
+                    paths = DocumentPaths(archive_path, new_key)
+                    conn.execute(insert, [new_key, document_stamp(paths)]
+                                 + list(row))
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+
+    def _update(self, conn, stamped_docs, removed):
+        ''' Insert or replace the records of the (stamp, document) pairs and
+            delete the records of the removed keys. '''
+        rows = []
+        for stamp, doc in stamped_docs:
+            try:
+                record = doc.record()
+            except LibraryException:
+                continue
+            for field in JSON_FIELDS:
+                record[field] = json.dumps(record[field])
+            rows.append([doc.key, stamp] + [record[f] for f in RECORD_FIELDS])
+
+        try:
+            with conn:
+                conn.executemany(
+                        'INSERT OR REPLACE INTO documents VALUES ({})'.format(
+                            ', '.join('?' * (len(RECORD_FIELDS) + 2))),
+                        rows)
+                conn.executemany('DELETE FROM documents WHERE key = ?',
+                                 [(key,) for key in removed])
+            if (rows or removed
+                    or not completion.have_words(os.path.dirname(self.path))):
+                self._save_completions(conn)
+        except sqlite3.Error:
+            # The catalog is only a cache, so failing to update it is not
+            # fatal.
+            pass
+        finally:
+            conn.close()
+
+    def _save_completions(self, conn):
+        ''' Save the lists of all cataloged tags and authors for shell
+            completion. '''
+        tags = set()
+        authors = set()
+        for doc_tags, doc_authors in conn.execute(
+                'SELECT tags, authors FROM documents'):
+            tags.update(json.loads(doc_tags))
+            authors.update(json.loads(doc_authors))
+        completion.save_words(os.path.dirname(self.path), tags, authors)
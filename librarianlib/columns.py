@@ -0,0 +1,125 @@
+import array
+
+
+def _year_number(year):
+    ''' The year as an int, or -1 if it isn't written as a plain number (in
+        which case it can only be matched as a string). '''
+    try:
+        number = int(year)
+    except (TypeError, ValueError):
+        return -1
+    return number if str(number) == year else -1
+
+
+class DocumentColumns(object):
+    ''' Columnar view of the metadata of a set of documents, for matching many
+        documents against a template at once. Each field is stored as one
+        sequence over all documents: years as an array of ints, entry types as
+        an array of codes into a table of the distinct types, tags as a bitset
+        per document, and authors pre-joined into a single string. The cheap
+        fields are matched in bulk first, and regexes are only evaluated for
+        the documents that remain. '''
+    def __init__(self, docs):
+        self.keys = []
+        self.titles = []
+        self.authors = []
+        self.year_strings = []
+        self.years = array.array('l')
+        self.venues = []
+        self.entrytypes = []
+        self.entrytype_codes = array.array('H')
+        self.tag_bits = []
+        self._entrytype_code = {}
+        self._tag_bit = {}
+
+        for doc in docs:
+            self.keys.append(doc.key)
+            self.titles.append(doc.title)
+            self.authors.append(' '.join(doc.authors))
+            self.year_strings.append(doc.year)
+            self.years.append(_year_number(doc.year))
+            self.venues.append(doc.venue)
+            self.entrytype_codes.append(self._code(doc.entrytype))
+            bits = 0
+            for tag in doc.tags:
+                bits |= self._bit(tag)
+            self.tag_bits.append(bits)
+
+    def _code(self, entrytype):
+        code = self._entrytype_code.get(entrytype)
+        if code is None:
+            code = len(self.entrytypes)
+            self._entrytype_code[entrytype] = code
+            self.entrytypes.append(entrytype)
+        return code
+
+    def _bit(self, tag):
+        bit = self._tag_bit.get(tag)
+        if bit is None:
+            bit = 1 << len(self._tag_bit)
+            self._tag_bit[tag] = bit
+        return bit
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _match_years(self, years, rows):
+        ''' Filter rows by the set of years (strings) of a template. '''
+        numbers = set(_year_number(year) for year in years)
+        if -1 in numbers:
+            # Some year isn't a plain number, so compare the strings.
+            year_strings = self.year_strings
+            return [i for i in rows if year_strings[i] in years]
+        lo, hi = min(numbers), max(numbers)
+        column = self.years
+        if hi - lo + 1 == len(numbers):
+            return [i for i in rows if lo <= column[i] <= hi]
+        return [i for i in rows if column[i] in numbers]
+
+    def match(self, tmpl):
+        ''' Return the keys of the documents matching the metadata fields of a
+            DocumentTemplate, that is, all but the text pattern. The results
+            are the same as DocumentTemplate.matches_metadata. '''
+        rows = range(len(self.keys))
+
+        if tmpl.entrytype_pattern:
+            # There are only a handful of distinct entry types, so the pattern
+            # is checked once against each rather than for each document.
+            codes = set(code for code, entrytype in enumerate(self.entrytypes)
+                        if tmpl.entrytype_pattern in entrytype)
+            column = self.entrytype_codes
+            rows = [i for i in rows if column[i] in codes]
+
+        if tmpl.years:
+            rows = self._match_years(tmpl.years, rows)
+
+        if tmpl.tag_list:
+            if any(tag not in self._tag_bit for tag in tmpl.tag_list):
+                return []
+            mask = 0
+            for tag in tmpl.tag_list:
+                mask |= self._tag_bit[tag]
+            column = self.tag_bits
+            rows = [i for i in rows if column[i] & mask == mask]
+
+        # The regexes are the most expensive, so they come last.
+        if tmpl.key_regex:
+            search = tmpl.key_regex.search
+            column = self.keys
+            rows = [i for i in rows if search(column[i])]
+        if tmpl.venue_regex:
+            search = tmpl.venue_regex.search
+            column = self.venues
+            rows = [i for i in rows if column[i] and search(column[i])]
+        if tmpl.title_regex:
+            search = tmpl.title_regex.search
+            column = self.titles
+            rows = [i for i in rows if search(column[i])]
+        if tmpl.author_regexes:
+            column = self.authors
+            for regex in tmpl.author_regexes:
+                search = regex.search
+                rows = [i for i in rows if search(column[i])]
+
+        keys = self.keys
+        return [keys[i] for i in rows]
@@ -1,11 +1,9 @@
 import os
-import shutil
-import subprocess
+import sys
 import textwrap
 
-import editor
-
-from . import style
+from . import completion, daemon_client, style
+from .exceptions import LibraryException
 
 
 def _summarize_doc(doc, count, verbosity):
@@ -38,6 +36,46 @@ def _summarize_doc(doc, count, verbosity):
                        venue=doc.venue, count=count)
 
 
+def _print_progress(done, total):
+    ''' Report the progress of text extraction on stderr. '''
+    if not sys.stderr.isatty():
+        return
+    end = '\n' if done == total else '\r'
+    print('Extracting text: {}/{}'.format(done, total), end=end,
+          file=sys.stderr, flush=True)
+
+
+def _warn(message):
+    print('Warning: {}'.format(message), file=sys.stderr)
+
+
+def _extract_in_background():
+    ''' Extract the text of new documents with 'lib extract', in a detached
+        process that carries on after this one exits. '''
+    import subprocess
+    subprocess.Popen([sys.executable, os.path.realpath(sys.argv[0]),
+                      'extract'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def _search_filters(kwargs):
+    ''' Extract the arguments for LibraryManager.search_docs from the filter
+        options of a command. '''
+    return {
+        'key': kwargs['key'],
+        'title': kwargs['title'],
+        'author': kwargs['author'],
+        'year': kwargs['year'],
+        'venue': kwargs['venue'],
+        'entrytype': kwargs['type'],
+        'text': kwargs['text_pattern'],
+        'tags': kwargs['tags'],
+        'opened': kwargs['opened'],
+        'query': kwargs['query'],
+    }
+
+
 def _sanitize_key(key):
     ''' Clean up a user-supplied document key. '''
     if key is None:
@@ -60,7 +98,10 @@ class LibraryCommandInterface(object):
         ''' Open a document for viewing. '''
         key = _sanitize_key(kwargs['key'])
         doc = self.manager.get_doc(key)
-        doc.access()
+        doc.access(self.manager.date_log)
+
+        # editor is only needed here, so don't make every command import it.
+        import editor
         if kwargs['bib']:
             editor.edit(doc.paths.bib_path)
         elif kwargs['tag']:
@@ -71,32 +112,49 @@ class LibraryCommandInterface(object):
             except FileNotFoundError:
                 pass
         else:
+            import subprocess
             cmd = 'nohup xdg-open {} >/dev/null 2>&1 &'.format(doc.paths.pdf_path)
             subprocess.run(cmd, shell=True)
 
     def link(self, **kwargs):
         ''' Create a symlink to the document in the archive. '''
-        key = _sanitize_key(kwargs['key'])
-
         if kwargs['fix']:
-            if os.path.isdir(key):
-                self.manager.fix_links(key)
-            else:
-                self.manager.fix_link(key)
+            return self.fix_links(kwargs['key'], kwargs['recursive'])
+        if kwargs['key'] is None:
+            raise LibraryException('A key is required.')
+        key = _sanitize_key(kwargs['key'])
+        self.manager.link(key, kwargs['name'])
+
+    def fix_links(self, path, recursive):
+        ''' Fix a broken link, the links in a directory, or every link lib
+            knows of. '''
+        if path is not None and os.path.islink(path):
+            self.manager.fix_link(path)
+            return 0
+
+        if path is not None:
+            if not os.path.isdir(path):
+                raise LibraryException('{} is not a symlink.'.format(path))
+            fixed, missing = self.manager.fix_links(path, recursive=recursive)
+        elif recursive:
+            fixed, missing = self.manager.fix_links(
+                    self.manager.shelves_path, self.manager.bookmarks_path,
+                    recursive=True)
+        elif self.manager.link_registry.exists():
+            fixed, missing = self.manager.fix_registered_links()
         else:
-            self.manager.link(key, kwargs['name'])
+            raise LibraryException('No links have been recorded yet. Use -r '
+                                   'to search the shelves and bookmarks.')
+
+        for link in missing:
+            print('No document in the archive for {}.'.format(link))
+        print('Fixed {} link{}.'.format(len(fixed),
+                                        '' if len(fixed) == 1 else 's'))
+        return 1 if missing else 0
 
     def browse(self, **kwargs):
         ''' Browse/search documents. '''
-        # Filters.
-        author = kwargs['author']
-        year = kwargs['year']
-        title = kwargs['title']
-        key = kwargs['key']
-        venue = kwargs['venue']
-        entrytype = kwargs['type']
-        text = kwargs['text']
-        tags = kwargs['tags']
+        filters = _search_filters(kwargs)
 
         # Display options.
         sort = kwargs['sort']
@@ -104,52 +162,69 @@ class LibraryCommandInterface(object):
         reverse = kwargs['reverse']
         verbosity = kwargs['verbose'] if kwargs['verbose'] else 0
 
-        results = self.manager.search_docs(key=key, title=title, author=author,
-                                           year=year, venue=venue,
-                                           entrytype=entrytype, text=text,
-                                           tags=tags, sort=sort,
-                                           reverse=reverse)
-        # Limit the number of results.
-        if number:
-            results = results[:number]
-
-        # Format the results.
-        summaries = []
-        for doc, count in results:
-            summaries.append(_summarize_doc(doc, count, verbosity))
-
-        if len(summaries) == 0:
-            return
-        elif verbosity > 0:
-            summary = '\n\n'.join(summaries)
-        else:
-            summary = '\n'.join(summaries)
-        print(summary)
+        results = self.manager.search_docs(sort=sort, reverse=reverse,
+                                           limit=number,
+                                           progress=_print_progress,
+                                           **filters)
+
+        # Print the results as they come in, separated by blank lines if
+        # verbose.
+        for i, (doc, count) in enumerate(results):
+            if i > 0 and verbosity > 0:
+                print()
+            print(_summarize_doc(doc, count, verbosity))
 
     def compile(self, **kwargs):
         ''' Compile a single bibtex file and/or a single directory of PDFs. '''
-        docs = self.manager.all_docs()
+        filters = _search_filters(kwargs)
 
         # Compile all bibtex into a single file.
         if kwargs['bib']:
-            bibtex = '\n\n'.join([doc.bibtex_str for doc in docs])
-            with open('bibtex.bib', 'w') as f:
-                f.write(bibtex)
-            print('Compiled bibtex files to bibtex.bib.')
+            path = kwargs['output']
+            count = self.manager.compile_bibtex(
+                    path, incremental=kwargs['incremental'],
+                    progress=_print_progress, **filters)
+            if count is None:
+                print('{} is up to date.'.format(path))
+            else:
+                print('Compiled {} bibtex entries to {}.'.format(count, path))
 
         # Compile all PDFs into a single directory.
         if kwargs['text']:
-            os.mkdir('text')
-            for doc in docs:
-                shutil.copy(doc.paths.pdf_path, 'text')
-            print('Copied PDFs to text/.')
+            directory = kwargs['directory']
+            exported, skipped = self.manager.export_pdfs(
+                    directory, link=kwargs['link'], threads=kwargs['threads'],
+                    progress=_print_progress, **filters)
+            print('Exported {} PDFs to {}.'.format(exported, directory))
+            if skipped:
+                print('{} PDFs were already up to date.'.format(skipped))
+
+    def extract(self, **kwargs):
+        ''' Extract the text of all documents whose cached text is stale. '''
+        extracted, failed = self.manager.extract_text(
+                processes=kwargs['processes'], progress=_print_progress,
+                verify=kwargs['verify'], retry_failed=kwargs['retry_failed'])
+        print('Extracted text of {} documents.'.format(extracted))
+        if failed:
+            print('Failed to extract text of {} documents.'.format(failed))
 
     def add(self, **kwargs):
         ''' Add a PDF and associated bibtex file to the archive. '''
+        if kwargs['batch']:
+            if kwargs['pdf'] or kwargs['bibtex']:
+                raise LibraryException('Give either a directory with --batch, '
+                                       'or a PDF and bibtex file, not both.')
+            self.add_batch(**kwargs)
+            return
+
         pdf_file_name = kwargs['pdf']
         bib_file_name = kwargs['bibtex']
+        if not pdf_file_name or not bib_file_name:
+            raise LibraryException('Both a PDF and a bibtex file are needed.')
 
-        doc = self.manager.add(pdf_file_name, bib_file_name)
+        doc = self.manager.add(pdf_file_name, bib_file_name,
+                               allow_duplicates=kwargs['allow_duplicates'],
+                               warn=_warn)
 
         if kwargs['delete']:
             os.remove(pdf_file_name)
@@ -160,6 +235,44 @@ class LibraryCommandInterface(object):
 
         print('Archived to {}.'.format(doc.key))
 
+    def add_batch(self, **kwargs):
+        ''' Add every PDF and bibtex pair in a directory to the archive, then
+            extract their text in the background. '''
+        from .batch import find_pairs
+        pending, problems = find_pairs(kwargs['batch'])
+        docs = self.manager.add_batch(
+                pending, tags=kwargs['tag'], link=kwargs['delete'],
+                threads=kwargs['threads'], problems=problems,
+                allow_duplicates=kwargs['allow_duplicates'], warn=_warn)
+
+        if kwargs['delete']:
+            for item in pending:
+                os.remove(item.pdf_path)
+                os.remove(item.bib_path)
+
+        print('Archived {} documents.'.format(len(docs)))
+        if docs:
+            _extract_in_background()
+
+    def dedupe(self, **kwargs):
+        ''' Report documents that are likely to be duplicates. '''
+        identical, similar = self.manager.find_duplicates()
+        if identical:
+            print('Identical PDFs:')
+            for keys in identical:
+                print('  ' + ' '.join(keys))
+        if similar:
+            print('Similar titles and authors:')
+            for keys in similar:
+                print('  ' + ' '.join(keys))
+        if not identical and not similar:
+            print('No duplicates found.')
+
+    def index(self, **kwargs):
+        ''' Generate an HTML index of all documents. '''
+        written, total = self.manager.write_index(kwargs['output'])
+        print('Updated {} of {} files in the index.'.format(written, total))
+
     def where(self, **kwargs):
         ''' Print out library directories. '''
         print(self.manager.archive_path)
@@ -171,22 +284,52 @@ class LibraryCommandInterface(object):
         key = _sanitize_key(kwargs['key'])
         self.manager.bookmark(key, kwargs['name'])
 
+    def daemon(self, **kwargs):
+        ''' Run the daemon in the foreground, or stop it. '''
+        if kwargs['stop']:
+            if daemon_client.stop(self.manager.path):
+                print('Stopped the daemon.')
+            else:
+                print('The daemon is not running.')
+            return
+
+        # The daemon pulls in the whole library, so only import it here.
+        from . import daemon
+        daemon.serve(self.manager.config_file_path)
+
     def complete(self, **kwargs):
         ''' Print completions for commands. '''
-        keys = self.manager.all_keys()
-        print(' '.join(keys))
+        what = 'tags' if kwargs['tags'] else None
+        what = 'authors' if kwargs['authors'] else what
+        print(completion.completions(self.manager.path, what))
 
     def rekey(self, **kwargs):
         ''' Change the name of a key. '''
+        if kwargs['all']:
+            if kwargs['key'] is not None:
+                raise LibraryException('--all does not take a key.')
+            renames = self.manager.bibtex_renames()
+            self.manager.rekey_batch(renames)
+            for key, new_key in renames:
+                print('Renamed {} to {}.'.format(key, new_key))
+            if not renames:
+                print('Every key already matches its bibtex.')
+            return
+
+        if kwargs['key'] is None:
+            raise LibraryException('A key is required.')
+        if kwargs['from_bibtex'] and kwargs['new-key'] is not None:
+            raise LibraryException('--from-bibtex does not take a new key.')
         key = _sanitize_key(kwargs['key'])
         new_key = self.manager.rekey(key, kwargs['new-key'])
         print('Renamed {} to {}.'.format(key, new_key))
 
     def add_tags(self, **kwargs):
-        keys = kwargs['keys']
-        tags = kwargs['tags']
+        ''' Apply tags to documents. '''
+        keys = [_sanitize_key(key) for key in kwargs['key']]
+        tags = kwargs['tag']
         for key in keys:
-            self.manager.get_doc(key).tag(tags)
+            self.manager.tag(key, tags)
 
     def list_tags(self, **kwargs):
         ''' List all tags. '''
@@ -196,6 +339,8 @@ class LibraryCommandInterface(object):
             print('Renamed all instances of {} to {}.'.format(current_tag, new_tag))
         else:
             tag_count_list = self.manager.get_tags()
+            if not tag_count_list:
+                return
             n = kwargs['number'] if kwargs['number'] else len(tag_count_list)
             l = len(max(tag_count_list, key=lambda x: len(x[0]))[0])
             tmpl = '{tag:<{l}} {count}'
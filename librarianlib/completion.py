@@ -0,0 +1,105 @@
+# Shell completion. This runs on every TAB press, so it must stay cheap: it
+# only imports from the standard library and reads plain text lists of keys,
+# tags and authors from the library's cache directory.
+import os
+
+from .config import CACHE_DIR_NAME, find_config, read_library_path
+from .fileops import write_atomic
+
+
+KEYS_FILE_NAME = 'keys.txt'
+TAGS_FILE_NAME = 'tags.txt'
+AUTHORS_FILE_NAME = 'authors.txt'
+
+
+def _write_lines(path, lines):
+    ''' Atomically write lines to a file in the cache. The cache is only an
+        optimization, so failure to write it is ignored. '''
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, '\n'.join(lines))
+    except OSError:
+        pass
+
+
+def update_keys(cache_path, archive_path):
+    ''' Rewrite the cached list of keys from the archive. The list is stamped
+        with the modification time of the archive directory, which changes
+        whenever a document is added, removed or renamed. Returns the
+        keys. '''
+    mtime = os.stat(archive_path).st_mtime_ns
+    keys = sorted(os.listdir(archive_path))
+    _write_lines(os.path.join(cache_path, KEYS_FILE_NAME),
+                 [str(mtime)] + keys)
+    return keys
+
+
+def read_keys(cache_path, archive_path):
+    ''' Read the cached list of keys, rebuilding it if the archive has changed
+        since it was written. '''
+    mtime = os.stat(archive_path).st_mtime_ns
+    try:
+        with open(os.path.join(cache_path, KEYS_FILE_NAME)) as f:
+            if int(f.readline()) == mtime:
+                return f.read().split('\n')
+    except (OSError, ValueError):
+        pass
+    return update_keys(cache_path, archive_path)
+
+
+def save_words(cache_path, tags, authors):
+    ''' Save the lists of all tags and authors for completion. '''
+    _write_lines(os.path.join(cache_path, TAGS_FILE_NAME), sorted(tags))
+    _write_lines(os.path.join(cache_path, AUTHORS_FILE_NAME), sorted(authors))
+
+
+def have_words(cache_path):
+    ''' Returns True if the lists of tags and authors have been saved. '''
+    return (os.path.exists(os.path.join(cache_path, TAGS_FILE_NAME))
+            and os.path.exists(os.path.join(cache_path, AUTHORS_FILE_NAME)))
+
+
+def read_words(cache_path, file_name):
+    ''' Read a cached list of words, one per line. Returns an empty list if
+        the list hasn't been cached yet. '''
+    try:
+        with open(os.path.join(cache_path, file_name)) as f:
+            return f.read().split('\n')
+    except OSError:
+        return []
+
+
+def completions(library_path, what=None):
+    ''' Return the completion output for keys (the default), 'tags' or
+        'authors'. Keys and tags are separated by spaces, authors by
+        newlines, since names contain spaces. '''
+    cache_path = os.path.join(library_path, CACHE_DIR_NAME)
+    if what == 'tags':
+        return ' '.join(read_words(cache_path, TAGS_FILE_NAME))
+    if what == 'authors':
+        return '\n'.join(read_words(cache_path, AUTHORS_FILE_NAME))
+    archive_path = os.path.join(library_path, 'archive')
+    return ' '.join(read_keys(cache_path, archive_path))
+
+
+def main(search_dirs, config_name, args):
+    ''' Entry point for 'lib complete', bypassing the full command line
+        interface. Prints nothing if the library can't be found. '''
+    config_path = find_config(search_dirs, config_name)
+    if config_path is None:
+        return 1
+    library_path = read_library_path(config_path)
+    if library_path is None:
+        return 1
+
+    what = None
+    if '--tags' in args:
+        what = 'tags'
+    elif '--authors' in args:
+        what = 'authors'
+
+    try:
+        print(completions(library_path, what))
+    except OSError:
+        return 1
+    return 0
@@ -0,0 +1,33 @@
+import os
+
+
+# Name of the directory at the root of the library holding the caches and
+# indexes maintained by the tool.
+CACHE_DIR_NAME = '.librarian'
+
+# Name of the file at the root of the library logging the dates documents were
+# added and opened. Unlike the caches, it can't be rebuilt.
+DATE_LOG_NAME = 'dates.log'
+
+
+def find_config(search_dirs, config_name):
+    ''' Find the path to the configuration file. '''
+    for search_dir in search_dirs:
+        path = os.path.join(search_dir, config_name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_library_path(config_path):
+    ''' Read just the library path from the configuration file, without
+        loading a YAML parser. Returns None if the path can't be found this
+        way. '''
+    with open(config_path) as f:
+        for line in f:
+            if line.startswith('library:'):
+                value = line.split(':', 1)[1].split(' #')[0].strip()
+                value = value.strip('\'"')
+                if value:
+                    return os.path.expanduser(value)
+    return None
@@ -0,0 +1,366 @@
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import json
+import os
+import select
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+
+from . import daemon_client
+from .columns import DocumentColumns
+from .command_interface import LibraryCommandInterface
+from .document import DocumentPaths, ArchivalDocument
+from .exceptions import LibraryException
+from .management import LibraryManager
+from .tagindex import TagIndex
+
+
+# Constants from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# The archive directory is watched for documents being added, removed or
+# rekeyed; the directory of each document and its metadata for any change to
+# the files in them.
+ARCHIVE_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+DOCUMENT_MASK = ARCHIVE_MASK | IN_ATTRIB | IN_CLOSE_WRITE
+
+# struct inotify_event, without the trailing name.
+EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds without requests after which pending changes are applied, and the
+# text of changed PDFs extracted, in the background.
+IDLE_TIMEOUT = 1.0
+
+
+class Inotify(object):
+    ''' Minimal wrapper around the Linux inotify API. '''
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                     use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise LibraryException('The daemon requires inotify, which is '
+                                   'only available on Linux.')
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            msg = 'Failed to initialize inotify: {}'.format(
+                    os.strerror(ctypes.get_errno()))
+            raise LibraryException(msg)
+
+    def add_watch(self, path, mask):
+        ''' Watch a path. Returns the watch descriptor, or None if the path
+            can't be watched, e.g. because it has just been removed. '''
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        return wd if wd >= 0 else None
+
+    def read(self):
+        ''' Read all pending events. Returns a list of (watch descriptor, mask,
+            name) tuples. '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HotLibraryManager(LibraryManager):
+    ''' Library manager that keeps every document in memory, along with the tag
+        and text indexes, and keeps them up to date by watching the archive
+        with inotify rather than rediscovering it on every command. '''
+    def __init__(self, search_dirs, config_name):
+        super().__init__(search_dirs, config_name)
+        self.inotify = Inotify()
+        self._archive_wd = self.inotify.add_watch(self.archive_path,
+                                                  ARCHIVE_MASK)
+        self._watches = {}
+        self.docs = {}
+        self._columns = None
+        self._dirty = set()
+        self._overflow = False
+        self._stale_text = set()
+        self._text_index_usable = True
+        self.load()
+
+    def _watch(self, key):
+        ''' Watch the directory of a document and its metadata. '''
+        paths = DocumentPaths(self.archive_path, key)
+        for path in (paths.key_path, paths.metadata_path):
+            wd = self.inotify.add_watch(path, DOCUMENT_MASK)
+            if wd is not None:
+                self._watches[wd] = key
+
+    def load(self):
+        ''' Load every document in the archive. Documents are watched before
+            they are read, so that no change goes unnoticed. '''
+        keys = []
+        with os.scandir(self.archive_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self._watch(entry.name)
+                    keys.append(entry.name)
+        self.docs = {doc.key: doc
+                     for doc in self.catalog.documents(self.archive_path, keys)}
+        self._columns = None
+        # Start from a fresh tag index, so that it is checked against every
+        # tag file.
+        self.tag_index = TagIndex(self.tag_index.path, self.archive_path)
+        self.tag_index.load()
+        self._dirty = set()
+        self._overflow = False
+        self._stale_text = set(keys)
+
+    def handle_events(self):
+        ''' Record which documents have changed according to the pending
+            inotify events. '''
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so we no longer know what changed.
+                self._overflow = True
+            elif mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+            elif wd == self._archive_wd:
+                if not name:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                    self._watch(name)
+                self._dirty.add(name)
+            elif wd in self._watches:
+                key = self._watches[wd]
+                # The metadata directory is only created once something is
+                # first written to it.
+                if mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                    self._watch(key)
+                self._dirty.add(key)
+
+    def pending(self):
+        ''' Returns True if there are changes that haven't been applied yet. '''
+        return bool(self._dirty or self._overflow or self._stale_text)
+
+    def update(self):
+        ''' Reload the documents that have changed since the last update. '''
+        self.handle_events()
+        if self._overflow:
+            self.load()
+            return
+        if not self._dirty:
+            return
+
+        dirty = self._dirty
+        self._dirty = set()
+        changed = []
+        for key in dirty:
+            paths = DocumentPaths(self.archive_path, key)
+            if os.path.isdir(paths.key_path):
+                changed.append(ArchivalDocument(key, paths))
+            else:
+                self.docs.pop(key, None)
+                self._stale_text.discard(key)
+
+        keys = set(self.docs).union(doc.key for doc in changed)
+        for doc in self.catalog.fill(changed, prune_keys=keys):
+            self.docs[doc.key] = doc
+        self.tag_index.refresh(dirty)
+        self._columns = None
+        self._stale_text.update(doc.key for doc in changed)
+
+        removed = dirty.difference(keys)
+        if removed:
+            try:
+                self.text_index.remove(removed)
+            except (OSError, sqlite3.Error):
+                pass
+
+    def all_keys(self):
+        return list(self.docs)
+
+    def all_docs(self):
+        docs = list(self.docs.values())
+        self._load_dates(docs)
+        return docs
+
+    def get_doc(self, key):
+        if key in self.docs:
+            doc = self.docs[key]
+            self._load_dates([doc])
+            return doc
+        return super().get_doc(key)
+
+    def _scan_keys(self, tmpl):
+        return [key for key in self.docs if tmpl.key(key)]
+
+    def _documents(self, keys):
+        return (self.docs[key] for key in keys)
+
+    def _match_metadata(self, tmpl):
+        ''' Match against a columnar view of the documents, which is only
+            rebuilt after they change, rather than each document in turn. '''
+        if self._columns is None:
+            self._columns = DocumentColumns(self.docs.values())
+        keys = self._columns.match(tmpl)
+        if tmpl.opened_days is not None:
+            opened = self._opened_keys(tmpl.opened_days)
+            keys = [key for key in keys if key in opened]
+        return [self.docs[key] for key in keys]
+
+    def _refresh_text(self, docs, progress=None):
+        ''' Only the text of documents that have changed since it was last
+            refreshed needs to be checked. '''
+        stale = [doc for doc in docs if doc.key in self._stale_text]
+        if stale:
+            self._text_index_usable = super()._refresh_text(stale, progress)
+            self._stale_text.difference_update(doc.key for doc in stale)
+        return self._text_index_usable
+
+    def refresh_text(self):
+        ''' Extract and index the text of every document that has changed. '''
+        self._refresh_text(self.all_docs())
+
+    def close(self):
+        self.inotify.close()
+        self.text_index.close()
+
+
+class _Output(io.StringIO):
+    ''' Buffer for the output of a command, which is a terminal if the
+        client's output is, so that output is styled as if the command had
+        been run directly. '''
+    def __init__(self, tty):
+        super().__init__()
+        self._tty = tty
+
+    def isatty(self):
+        return self._tty
+
+
+def _listen(path):
+    ''' Listen on the Unix socket at path, removing a stale socket left behind
+        by a daemon that didn't exit cleanly. '''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+    except FileNotFoundError:
+        pass
+    except ConnectionRefusedError:
+        os.remove(path)
+    except OSError as e:
+        raise LibraryException('Cannot use socket {}: {}'.format(path, e))
+    else:
+        raise LibraryException('The daemon is already running.')
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+    except OSError as e:
+        server.close()
+        raise LibraryException('Cannot use socket {}: {}'.format(path, e))
+    server.listen()
+    return server
+
+
+def _handle(conn, manager, interface):
+    ''' Answer a request from the command line. Returns False if the daemon
+        has been asked to stop. '''
+    data = b''.join(iter(lambda: conn.recv(65536), b''))
+    try:
+        request = json.loads(data.decode())
+        command = request['command']
+        args = request.get('args')
+    except (ValueError, KeyError, TypeError):
+        return True
+
+    if command == 'stop':
+        conn.sendall(json.dumps({'status': 0, 'output': ''}).encode())
+        return False
+
+    output = _Output(request.get('tty', False))
+    try:
+        if command not in daemon_client.COMMANDS:
+            raise ValueError('Unsupported command {}'.format(command))
+        manager.update()
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(io.StringIO()):
+            getattr(interface, command)(**args)
+        reply = {'status': 0, 'output': output.getvalue()}
+    except LibraryException as e:
+        reply = {'status': 1, 'output': output.getvalue() + e.message + '\n'}
+    except Exception:
+        # Rather than fail, have the command line run the command itself.
+        reply = {'fallback': True}
+    conn.sendall(json.dumps(reply).encode())
+    return True
+
+
+def serve(config_file_path):
+    ''' Run the daemon in the foreground until it is stopped, answering
+        queries from the command line over a Unix socket in the cache
+        directory. '''
+    manager = HotLibraryManager([os.path.dirname(config_file_path)],
+                                os.path.basename(config_file_path))
+    interface = LibraryCommandInterface(manager)
+    path = daemon_client.socket_path(manager.path)
+    server = _listen(path)
+
+    # Make sure the socket is removed if we're killed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Serving {} on {}.'.format(manager.path, path), flush=True)
+
+    try:
+        running = True
+        # Once catching up fails, it isn't tried again until something
+        # changes, rather than failing over and over.
+        idle_failed = False
+        while running:
+            timeout = (IDLE_TIMEOUT if manager.pending() and not idle_failed
+                       else None)
+            readable, _, _ = select.select([server, manager.inotify.fd], [], [],
+                                           timeout)
+            if manager.inotify.fd in readable:
+                manager.handle_events()
+                idle_failed = False
+            if server in readable:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        running = _handle(conn, manager, interface)
+                    except OSError:
+                        # The client went away.
+                        pass
+            elif not readable:
+                # Idle, so catch up with changes before they're asked for.
+                try:
+                    manager.update()
+                    manager.refresh_text()
+                except Exception as e:
+                    print('Failed to catch up with changes to the library: '
+                          '{!r}'.format(e), file=sys.stderr, flush=True)
+                    idle_failed = True
+    finally:
+        server.close()
+        os.remove(path)
+        manager.close()
@@ -0,0 +1,73 @@
+# Client side of the daemon. This is imported on every run of a command the
+# daemon can answer, so like completion it only uses the standard library and
+# doesn't import the rest of the package.
+import json
+import os
+import socket
+import sys
+
+from .config import CACHE_DIR_NAME, find_config, read_library_path
+
+
+SOCKET_NAME = 'daemon.sock'
+
+# Seconds to wait for the daemon to accept a connection before running the
+# command directly instead.
+CONNECT_TIMEOUT = 1.0
+
+# Commands the daemon runs on behalf of the command line. The rest either
+# depend on the caller's working directory or terminal, or are cheap anyway,
+# so they always run directly.
+COMMANDS = ['browse', 'list_tags']
+
+
+def socket_path(library_path):
+    ''' Path of the socket the daemon for a library listens on. '''
+    return os.path.join(library_path, CACHE_DIR_NAME, SOCKET_NAME)
+
+
+def send(path, message):
+    ''' Send a message to the daemon listening at path and return its reply.
+        Raises OSError if no daemon is listening. '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(None)
+        sock.sendall(json.dumps(message).encode())
+        sock.shutdown(socket.SHUT_WR)
+        data = b''.join(iter(lambda: sock.recv(65536), b''))
+    return json.loads(data.decode())
+
+
+def run(search_dirs, config_name, command, args):
+    ''' Run a command in the daemon, if one is running for the library.
+        Returns the exit status of the command, or None if it must be run
+        directly instead. '''
+    if command not in COMMANDS:
+        return None
+    config_path = find_config(search_dirs, config_name)
+    if config_path is None:
+        return None
+    library_path = read_library_path(config_path)
+    if library_path is None:
+        return None
+
+    message = {'command': command, 'args': args, 'tty': sys.stdout.isatty()}
+    try:
+        reply = send(socket_path(library_path), message)
+    except (OSError, ValueError):
+        return None
+    if reply.get('fallback'):
+        return None
+    sys.stdout.write(reply['output'])
+    return reply['status']
+
+
+def stop(library_path):
+    ''' Ask the daemon for a library to exit. Returns False if it isn't
+        running. '''
+    try:
+        send(socket_path(library_path), {'command': 'stop'})
+    except (OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,146 @@
+import contextlib
+import datetime
+import fcntl
+import os
+
+from .document import DATE_FORMAT
+from .fileops import file_stamp, write_atomic
+
+
+ADDED = 'added'
+ACCESSED = 'accessed'
+
+# The log is compacted once it has more than this many times the two lines
+# per document it needs, plus some slack so that small libraries aren't
+# compacted all the time.
+COMPACT_FACTOR = 2
+COMPACT_SLACK = 1000
+
+
+class DateLog(object):
+    ''' Log of the dates documents were added and last opened, kept in a
+        single file for the whole library, so that the dates of every document
+        can be read at once.
+
+        Each line records one event, as "date event key", and events are only
+        ever appended, so recording one is a single small write. Adding a
+        document resets the date it was last opened. Once enough of the lines
+        have been superseded by later ones, the log is rewritten with just the
+        latest of each. '''
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._dates = {}
+        self._lines = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _parse(self, text):
+        dates = {}
+        # Many documents share dates, so each date is only kept once.
+        seen = {}
+        lines = text.split('\n')
+        # The last line is incomplete, if it isn't empty.
+        for line in lines[:-1]:
+            try:
+                date, event, key = line.split(' ', 2)
+            except ValueError:
+                continue
+            date = seen.setdefault(date, date)
+            if event == ADDED:
+                dates[key] = (date, None)
+            elif event == ACCESSED:
+                added = dates[key][0] if key in dates else None
+                dates[key] = (added, date)
+        return dates, len(lines) - 1
+
+    def dates(self):
+        ''' Return a dictionary mapping each key in the log to a tuple
+            (added, accessed) of date strings, either of which may be None if
+            it was never recorded. The log is only read again once it has
+            changed. '''
+        stamp = file_stamp(self.path)
+        if stamp != self._stamp:
+            try:
+                with open(self.path) as f:
+                    text = f.read()
+            except FileNotFoundError:
+                text = ''
+            self._dates, self._lines = self._parse(text)
+            self._stamp = stamp
+        return self._dates
+
+    def opened_since(self, date):
+        ''' Return the set of keys of the documents last opened on or after a
+            date string. '''
+        return {key for key, (_, accessed) in self.dates().items()
+                if accessed is not None and accessed >= date}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        ''' Open the log for appending, with an exclusive lock that keeps
+            other processes from appending to or compacting it. '''
+        while True:
+            f = open(self.path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # If the log was compacted while we waited for the lock, the file
+            # we have open has been replaced.
+            if os.path.exists(self.path) and os.path.samestat(
+                    os.fstat(f.fileno()), os.stat(self.path)):
+                break
+            f.close()
+        try:
+            yield f
+        finally:
+            f.close()
+
+    def _rewrite(self, dates):
+        lines = []
+        for key, (added, accessed) in sorted(dates.items()):
+            if added is not None:
+                lines.append('{} {} {}\n'.format(added, ADDED, key))
+            if accessed is not None:
+                lines.append('{} {} {}\n'.format(accessed, ACCESSED, key))
+        write_atomic(self.path, ''.join(lines))
+
+    def _record(self, key, event):
+        ''' Record that an event happened to a document today. Returns the
+            date. '''
+        date = datetime.date.today().strftime(DATE_FORMAT)
+        with self._locked() as f:
+            f.write('{} {} {}\n'.format(date, event, key))
+            f.flush()
+            dates = self.dates()
+            if self._lines > COMPACT_FACTOR * 2 * len(dates) + COMPACT_SLACK:
+                self._rewrite(dates)
+        return date
+
+    def add(self, key):
+        ''' Record that a document was added today. Returns the date. '''
+        return self._record(key, ADDED)
+
+    def access(self, key):
+        ''' Record that a document was opened today. Returns the date. '''
+        return self._record(key, ACCESSED)
+
+    def record_all(self, dates):
+        ''' Record the (added, accessed) dates of many documents at once,
+            given as a dictionary mapping key to dates. '''
+        with self._locked():
+            current = dict(self.dates())
+            current.update(dates)
+            self._rewrite(current)
+
+    def rename_keys(self, renames):
+        ''' Move the dates of rekeyed documents, given as (old_key, new_key)
+            pairs, to their new keys. '''
+        if not self.exists():
+            return
+        with self._locked():
+            dates = dict(self.dates())
+            moved = [(new_key, dates.pop(old_key)) for old_key, new_key
+                     in renames if old_key in dates]
+            if moved:
+                dates.update(moved)
+                self._rewrite(dates)
@@ -2,46 +2,146 @@ import datetime
 import hashlib
 import os
 import re
-
-import textract
-import bibtexparser
+import sys
+import unicodedata
 
 from .exceptions import LibraryException
+from .fileops import write_atomic
 
 
 HASH_FILE_BUFFER_SIZE = 65536
-
-
-def _hash_pdf(pdf_path):
-    ''' Generate an MD5 hash of a PDF file. '''
-    md5 = hashlib.md5()
+HASH_DIGEST_SIZE = 16
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Entry types that bibtexparser keeps; entries of any other type are dropped.
+BIBTEX_STANDARD_TYPES = {
+    'article', 'book', 'booklet', 'conference', 'inbook', 'incollection',
+    'inproceedings', 'manual', 'mastersthesis', 'misc', 'phdthesis',
+    'proceedings', 'techreport', 'unpublished'}
+
+# Values of the month macros, which bibtexparser defines with
+# common_strings=True.
+BIBTEX_MONTHS = {
+    'jan': 'January', 'feb': 'February', 'mar': 'March', 'apr': 'April',
+    'may': 'May', 'jun': 'June', 'jul': 'July', 'aug': 'August',
+    'sep': 'September', 'oct': 'October', 'nov': 'November',
+    'dec': 'December'}
+
+# Start of an entry, up to the comma after its key, and the start of a field,
+# up to its value. Only whitespace that bibtexparser skips is allowed between
+# tokens.
+BIBTEX_ENTRY_REGEX = re.compile(
+        r'@[ \t\n\r]*([a-zA-Z]+)[ \t\n\r]*([{(])[ \t\n\r]*'
+        r'([^\s,{}()"#%\'=\\]+)[ \t\n\r]*,[ \t\n\r]*')
+BIBTEX_FIELD_REGEX = re.compile(
+        r'([a-zA-Z0-9_\-().+]+)[ \t\n\r]*=[ \t\n\r]*')
+BIBTEX_NUMBER_REGEX = re.compile(r'[0-9]+')
+BIBTEX_MACRO_REGEX = re.compile(r'[a-zA-Z0-9_\-:]+')
+BIBTEX_SPACE_REGEX = re.compile(r'[ \t\n\r]*')
+
+
+def _hash_pdf(pdf_path, legacy=False):
+    ''' Generate a BLAKE2 hash of a PDF file. If legacy is True, an MD5 hash
+        (as used by older versions of the metadata) is generated in the same
+        pass and a tuple (hash, md5_hash) is returned. '''
+    digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    md5 = hashlib.md5() if legacy else None
 
     with open(pdf_path, 'rb') as f:
         while True:
             data = f.read(HASH_FILE_BUFFER_SIZE)
             if not data:
                 break
-            md5.update(data)
+            digest.update(data)
+            if md5:
+                md5.update(data)
+
+    if legacy:
+        return digest.hexdigest(), md5.hexdigest()
+    return digest.hexdigest()
+
+
+def _stat_pdf(pdf_path):
+    ''' Summarize the size, modification time and inode of a PDF file as a
+        string. If these are unchanged, the PDF is assumed not to have
+        changed either. '''
+    st = os.stat(pdf_path)
+    return '{} {} {}'.format(st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _read_file(path):
+    ''' Read the contents of a small file, or return None if it doesn't
+        exist. '''
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
 
-    return md5.hexdigest()
+# Dates that have already been parsed. Documents share a limited number of
+# dates, and datetimes are immutable, so each date is parsed and stored once.
+_parsed_dates = {}
+
+
+def _parse_date(date):
+    ''' Parse a date string as stored in the document metadata. '''
+    parsed = _parsed_dates.get(date)
+    if parsed is None:
+        parsed = datetime.datetime.strptime(date, DATE_FORMAT)
+        _parsed_dates[date] = parsed
+    return parsed
+
+
+def _read_date(path):
+    ''' Read a date from a metadata file. Returns None if the file doesn't
+        exist or is malformed. '''
+    date = _read_file(path)
+    if date is None:
+        return None
+    try:
+        return _parse_date(date)
+    except ValueError:
+        return None
 
 
 def _parse_pdf_text(pdf_path):
-    ''' Extract plaintext content of a PDF file. '''
+    ''' Extract plaintext content of a PDF file.
+        Returns a tuple (text, failure). If extraction fails, text is None and
+        failure is a tuple (extractor, error) of the last extractor attempted
+        and the name of the class of error it raised. '''
+    # textract pulls in a large dependency tree, so only import it when text
+    # actually needs to be extracted.
+    import textract
+
     # Try using pdftotext and fallback to pdfminer if that doesn't work.
     try:
         text = textract.process(pdf_path, method='pdftotext')
-    except (TypeError, UnicodeDecodeError):
+    except (TypeError, UnicodeDecodeError, textract.exceptions.ShellError):
         try:
             text = textract.process(pdf_path, method='pdfminer')
-        except (TypeError, UnicodeDecodeError, textract.exceptions.ShellError):
-            return None
-    return text.decode('utf-8')
+        # pdfminer may raise any number of its own errors on malformed PDFs.
+        except Exception as e:
+            return None, ('pdfminer', type(e).__name__)
+    return text.decode('utf-8'), None
+
+
+def _latex_to_unicode(value):
+    ''' Convert the LaTeX in a bibtex value to unicode, exactly as
+        bibtexparser's convert_to_unicode customization does. Values without
+        any braces or commands are only normalized, which doesn't require
+        importing bibtexparser. '''
+    if '\\' in value or '{' in value or '}' in value:
+        from bibtexparser.latexenc import latex_to_unicode
+        return latex_to_unicode(value)
+    return unicodedata.normalize('NFC', value)
 
 
 def _bibtex_customizations(record):
     ''' Customizations to apply to bibtex record. '''
-    record = bibtexparser.customization.convert_to_unicode(record)
+    for field, value in record.items():
+        record[field] = _latex_to_unicode(value)
 
     # Make author names more consistent.
     # TODO I would like to embrace the paradigm that this tool is not
@@ -70,25 +170,122 @@ def _bibtex_customizations(record):
     return record
 
 
-def _load_bibtex(bib_path):
-    ''' Load bibtex information as a dictionary. '''
-
+def _scan_bibtex_value(text, i, closer):
+    ''' Scan the value of a field starting at index i of a bibtex entry.
+        Returns a tuple (value, i) of the value, as bibtexparser would read
+        it, and the index just past it, or None if the value is anything but
+        a single number, braced or quoted string, or month. '''
+    c = text[i:i + 1]
+    if c == '{' or c == '"':
+        depth = 0
+        for j in range(i + 1, len(text)):
+            if text[j] == '{':
+                depth += 1
+            elif text[j] == '}':
+                if depth == 0:
+                    if c == '{':
+                        break
+                    return None
+                depth -= 1
+            elif text[j] == '"' and c == '"' and depth == 0:
+                break
+        else:
+            return None
+        value, i = text[i + 1:j], j + 1
+    else:
+        match = BIBTEX_NUMBER_REGEX.match(text, i)
+        if match:
+            value = match.group()
+        else:
+            match = BIBTEX_MACRO_REGEX.match(text, i)
+            if not match or match.group().lower() not in BIBTEX_MONTHS:
+                return None
+            value = BIBTEX_MONTHS[match.group().lower()]
+        i = match.end()
+
+    # Lines after the first are stripped of indentation.
+    lines = value.splitlines()
+    value = '\n'.join(lines[:1] + [line.lstrip() for line in lines[1:]])
+    if value == '{}':
+        value = ''
+
+    i = BIBTEX_SPACE_REGEX.match(text, i).end()
+    if text[i:i + 1] not in (',', closer):
+        return None
+    return value, i
+
+
+def _scan_bibtex(text):
+    ''' Read a bibtex file consisting of a single, plain entry, without the
+        cost of running bibtexparser. Returns the entry as a dictionary,
+        exactly as bibtexparser with our customizations would, or None if the
+        file contains anything that only bibtexparser handles, such as
+        string definitions, concatenation or more than one entry. '''
+    # Like bibtexparser, which expands tabs before parsing.
+    text = text.expandtabs()
+    match = BIBTEX_ENTRY_REGEX.match(text)
+    if not match:
+        return None
+    entrytype = match.group(1).lower()
+    if entrytype not in BIBTEX_STANDARD_TYPES:
+        return None
+    closer = '}' if match.group(2) == '{' else ')'
+    key = match.group(3)
+
+    fields = {}
+    i = match.end()
+    while text[i:i + 1] != closer:
+        match = BIBTEX_FIELD_REGEX.match(text, i)
+        if not match:
+            return None
+        field = match.group(1).lower()
+        scanned = _scan_bibtex_value(text, match.end(), closer)
+        if scanned is None or field in fields:
+            return None
+        fields[field], i = scanned
+        if text[i] == ',':
+            i = BIBTEX_SPACE_REGEX.match(text, i + 1).end()
+    if i + 1 != len(text) or 'author' not in fields:
+        return None
+
+    # bibtexparser orders the fields last to first.
+    record = dict(reversed(list(fields.items())))
+    record['ENTRYTYPE'] = entrytype
+    record['ID'] = key
+    return _bibtex_customizations(record)
+
+
+def _read_bibtex(bib_path):
+    ''' Parse every entry in a bibtex file. Returns a tuple (entries, text) of
+        the list of entries, as dictionaries, and the raw contents. '''
     with open(bib_path) as f:
         text = f.read().strip()
 
+    # Almost every file in the archive is a single entry that can be read
+    # without bibtexparser, which is slow to import and run.
+    record = _scan_bibtex(text)
+    if record is not None:
+        return [record], text
+
+    import bibtexparser
+
     # common_strings=True lets us parse the month field as "jan",
     # "feb", etc.
     parser = bibtexparser.bparser.BibTexParser(
             customization=_bibtex_customizations,
             common_strings=True)
     try:
-        bibtex = bibtexparser.loads(text, parser=parser).entries_dict
+        entries = bibtexparser.loads(text, parser=parser).entries
     except:
         msg = 'Encountered an error while processing {}.'.format(bib_path)
         raise LibraryException(msg)
+    return entries, text
 
-    key = list(bibtex.keys())[0]
-    return bibtex[key], text
+
+def _load_bibtex(bib_path):
+    ''' Load bibtex information as a dictionary. '''
+    entries, text = _read_bibtex(bib_path)
+    return entries[0], text
 
 
 def _parse_bibtex(bibtex):
@@ -143,15 +340,15 @@ def _parse_author_pattern(pattern):
 
 
 def _parse_year_pattern(pattern):
-    ''' Parse the year text pattern into a list years (strings). '''
+    ''' Parse the year text pattern into a set of years (strings). '''
     if pattern:
         if '-' in pattern:
             years = pattern.split('-')
             first = int(years[0])
             last  = int(years[1])
-            years = [str(year) for year in range(first, last + 1)]
+            years = {str(year) for year in range(first, last + 1)}
             return years
-        return [pattern]
+        return {pattern}
     return None
 
 
@@ -165,7 +362,8 @@ class DocumentTemplate(object):
     ''' A template for matching documents. '''
     def __init__(self, key_pattern=None, title_pattern=None,
                  author_pattern=None, year_pattern=None, venue_pattern=None,
-                 entrytype_pattern=None, text_pattern=None, tag_pattern=None):
+                 entrytype_pattern=None, text_pattern=None, tag_pattern=None,
+                 opened_pattern=None):
         # Syntax: _pattern = string type, _regex = regex type
         self.key_regex = _pattern_to_regex(key_pattern)
         self.title_regex = _pattern_to_regex(title_pattern)
@@ -175,6 +373,11 @@ class DocumentTemplate(object):
         self.entrytype_pattern = entrytype_pattern
         self.text_regex = _pattern_to_regex(text_pattern)
         self.tag_list = _pattern_to_list(tag_pattern)
+        # Number of days within which documents must have been opened. Which
+        # documents have been is only known to the library's date log, so
+        # this is left to the library manager to check.
+        self.opened_days = (None if opened_pattern is None
+                            else int(opened_pattern))
 
     def key(self, key):
         ''' Test key match. '''
@@ -217,6 +420,8 @@ class DocumentTemplate(object):
         if not self.text_regex:
             return True, 0
         text = text_func()
+        if text is None:
+            return False, 0
         count = len(self.text_regex.findall(text))
         if count == 0:
             return False, 0
@@ -232,77 +437,240 @@ class DocumentTemplate(object):
         return True
 
 
+def _intern(value):
+    ''' Intern a string that is repeated across documents, such as a venue or
+        a tag, so that they all share a single copy. '''
+    return value if value is None else sys.intern(value)
+
+
+def _intern_info(title, authors, year, venue, entrytype):
+    ''' Intern the parts of a document's parsed metadata that are shared with
+        other documents: the authors, year, venue and entry type. '''
+    return (title, [sys.intern(author) for author in authors],
+            _intern(year), _intern(venue), _intern(entrytype))
+
+
 class DocumentPaths(object):
-    ''' Directory structure of a document in the archive. '''
+    ''' Directory structure of a document in the archive. Only the path of the
+        document's directory is stored; the rest are derived from it when
+        needed, since a whole library's worth are held at once. '''
+    __slots__ = ('key', 'key_path')
+
     def __init__(self, parent, key):
+        self.key = key
         self.key_path = os.path.join(parent, key)
-        self.pdf_path = os.path.join(self.key_path, key + '.pdf')
-        self.bib_path = os.path.join(self.key_path, key + '.bib')
-        self.tag_path = os.path.join(self.key_path, 'tags.txt')
 
-        self.metadata_path = os.path.join(self.key_path, '.metadata')
+    @property
+    def pdf_path(self):
+        return os.path.join(self.key_path, self.key + '.pdf')
+
+    @property
+    def bib_path(self):
+        return os.path.join(self.key_path, self.key + '.bib')
+
+    @property
+    def tag_path(self):
+        return os.path.join(self.key_path, 'tags.txt')
+
+    @property
+    def metadata_path(self):
+        return os.path.join(self.key_path, '.metadata')
+
+    @property
+    def hash_path(self):
+        return os.path.join(self.key_path, '.metadata', 'hash.b2')
+
+    @property
+    def legacy_hash_path(self):
+        return os.path.join(self.key_path, '.metadata', 'hash.md5')
+
+    @property
+    def stat_path(self):
+        return os.path.join(self.key_path, '.metadata', 'stat.txt')
+
+    @property
+    def failed_path(self):
+        return os.path.join(self.key_path, '.metadata', 'failed.txt')
+
+    @property
+    def text_path(self):
+        return os.path.join(self.key_path, '.metadata', 'text.txt')
 
-        self.hash_path = os.path.join(self.metadata_path, 'hash.md5')
-        self.text_path = os.path.join(self.metadata_path, 'text.txt')
-        self.accessed_path = os.path.join(self.metadata_path, 'accessed.txt')
-        self.added_path = os.path.join(self.metadata_path, 'added.txt')
+    @property
+    def accessed_path(self):
+        return os.path.join(self.key_path, '.metadata', 'accessed.txt')
+
+    @property
+    def added_path(self):
+        return os.path.join(self.key_path, '.metadata', 'added.txt')
 
 
 class ArchivalDocument(object):
-    ''' A document in an archive. '''
+    ''' A document in an archive. The bibtex, tags and dates of the document
+        are only read from disk when first accessed, and reading them never
+        writes anything. Whole libraries of documents are held in memory at
+        once, so they only have slots for their attributes, and strings that
+        repeat across documents are interned. '''
+    __slots__ = ('key', 'paths', '_bibtex', '_bibtex_str', '_info', '_tags',
+                 '_logged_dates', '_added_date', '_accessed_date',
+                 '_pdf_stat')
+
     # path contains key
     def __init__(self, key, paths):
         self.key = key
         self.paths = paths
 
-        self.bibtex, self.bibtex_str = _load_bibtex(paths.bib_path)
-        info = _parse_bibtex(self.bibtex)
-        self.title, self.authors, self.year, self.venue, self.entrytype = info
-
-        # Load tags.
-        if os.path.exists(self.paths.tag_path):
-            with open(self.paths.tag_path) as f:
-                self.tags = f.read().strip().split()
-        else:
-            self.tags = []
-
-        # Sanity checks.
-        if not os.path.exists(self.paths.metadata_path):
-            os.mkdir(self.paths.metadata_path)
-
-        # Dates.
-        self.added_date = self._read_date('added.txt')
-        self.accessed_date = self._read_date('accessed.txt')
+        self._bibtex = None
+        self._bibtex_str = None
+        self._info = None
+        self._tags = None
+        self._logged_dates = None
+        self._added_date = None
+        self._accessed_date = None
+        self._pdf_stat = None
+
+    def load_record(self, record):
+        ''' Fill in the metadata of the document from a previously parsed
+            record, so that it doesn't have to be read from disk. The bibtex
+            itself is still only read if it is needed. '''
+        self._info = _intern_info(record['title'], record['authors'],
+                                  record['year'], record['venue'],
+                                  record['entrytype'])
+        self._tags = [sys.intern(tag) for tag in record['tags']]
+
+    def load_dates(self, dates):
+        ''' Fill in the dates of the document from the library's date log, as
+            a tuple (added, accessed) of date strings, either of which may be
+            None. If dates is None, the document isn't in the log. '''
+        self._logged_dates = dates
+        self._added_date = None
+        self._accessed_date = None
+
+    def load_bibtex(self, bibtex, bibtex_str):
+        ''' Fill in the bibtex of the document, if it has already been parsed,
+            e.g. from the file the document was added from. '''
+        self._bibtex = bibtex
+        self._bibtex_str = bibtex_str
+
+    def record(self):
+        ''' Return the parsed metadata of the document as a dictionary of
+            plain values, suitable for caching. '''
+        return {
+            'title': self.title,
+            'authors': self.authors,
+            'year': self.year,
+            'venue': self.venue,
+            'entrytype': self.entrytype,
+            'tags': self.tags,
+        }
+
+    @property
+    def bibtex(self):
+        ''' Bibtex entry of the document, as a dictionary. '''
+        if self._bibtex is None:
+            # The raw contents are left to be read again if needed, rather
+            # than kept for every document.
+            self._bibtex, _ = _load_bibtex(self.paths.bib_path)
+        return self._bibtex
+
+    @property
+    def bibtex_str(self):
+        ''' Raw contents of the bibtex file. '''
+        if self._bibtex_str is None:
+            with open(self.paths.bib_path) as f:
+                self._bibtex_str = f.read().strip()
+        return self._bibtex_str
+
+    def _parsed_bibtex(self):
+        ''' Return the (title, authors, year, venue, entrytype) tuple parsed
+            from the bibtex. '''
+        if self._info is None:
+            self._info = _intern_info(*_parse_bibtex(self.bibtex))
+        return self._info
+
+    @property
+    def title(self):
+        return self._parsed_bibtex()[0]
+
+    @property
+    def authors(self):
+        return self._parsed_bibtex()[1]
+
+    @property
+    def year(self):
+        return self._parsed_bibtex()[2]
+
+    @property
+    def venue(self):
+        return self._parsed_bibtex()[3]
+
+    @property
+    def entrytype(self):
+        return self._parsed_bibtex()[4]
+
+    @property
+    def tags(self):
+        ''' List of tags applied to the document. '''
+        if self._tags is None:
+            tags = _read_file(self.paths.tag_path)
+            self._tags = ([sys.intern(tag) for tag in tags.split()] if tags
+                          else [])
+        return self._tags
+
+    def legacy_dates(self):
+        ''' Read the dates the document was added and last opened from its own
+            metadata files, where they were recorded before the date log.
+            Returns a tuple (added, accessed) of date strings. The
+            modification date of the bibtex file stands in for the date
+            added, and accessed is None if the document was never opened. '''
+        added = _read_date(self.paths.added_path)
+        if added is None:
+            mtime = os.path.getmtime(self.paths.bib_path)
+            added = datetime.date.fromtimestamp(mtime)
+        accessed = _read_date(self.paths.accessed_path)
+        return (added.strftime(DATE_FORMAT),
+                accessed.strftime(DATE_FORMAT) if accessed else None)
+
+    @property
+    def added_date(self):
+        ''' Date the document was added to the archive. If it was never
+            recorded, the modification date of the bibtex file is used. '''
+        if self._added_date is None:
+            added = None
+            if self._logged_dates is not None:
+                added = self._logged_dates[0]
+            if added is None:
+                added = self.legacy_dates()[0]
+            self._added_date = _parse_date(added)
+        return self._added_date
+
+    @property
+    def accessed_date(self):
+        ''' Date the document was last opened. Defaults to the date it was
+            added. '''
+        if self._accessed_date is None:
+            if self._logged_dates is not None:
+                accessed = self._logged_dates[1]
+            else:
+                accessed = self.legacy_dates()[1]
+            self._accessed_date = (_parse_date(accessed) if accessed
+                                   else self.added_date)
+        return self._accessed_date
 
     def _save_tags(self):
         ''' Save list of tags to a file. '''
-        with open(self.paths.tag_path, 'w') as f:
-            f.write('\n'.join(self.tags))
-
-    def _read_date(self, fname):
-        path = os.path.join(self.paths.metadata_path, fname)
-        if os.path.exists(path):
-            with open(path) as f:
-                date = f.read()
-            try:
-                return datetime.datetime.strptime(date, '%Y-%m-%d')
-            # Malformed date.
-            except ValueError:
-                pass
-
-        date = datetime.date.today()
-        with open(path, 'w') as f:
-            f.write(date.isoformat())
-        return date
+        write_atomic(self.paths.tag_path, '\n'.join(self.tags))
 
     def rename_tag(self, current_tag, new_tag):
-        ''' Rename a tag, if it has been applied to this document. '''
+        ''' Rename a tag, if it has been applied to this document. Returns True
+            if the tag was renamed. '''
         try:
             idx = self.tags.index(current_tag)
-            self.tags[idx] = new_tag
-            self._save_tags()
         except ValueError:
-            pass
+            return False
+        self.tags[idx] = new_tag
+        self._save_tags()
+        return True
 
     def tag(self, tags):
         ''' Add one or more tags to the document. 'tags' may be a string
@@ -313,46 +681,145 @@ class ArchivalDocument(object):
             self.tags.append(tags)
         self._save_tags()
 
-    def text(self):
-        ''' Retrieve the plain text of the PDF file.
-            Returns a tuple (text, new) : (str, bool)'''
-        current_hash = _hash_pdf(self.paths.pdf_path)
+    def text_status(self, verify=False, retry_failed=False):
+        ''' Check whether the cached plain text of the PDF file is up to date.
+            The PDF is only hashed if its size, modification time or inode
+            have changed since the text was extracted, or if verify is True.
+            A recorded failure to extract text from an unchanged PDF counts as
+            up to date, unless retry_failed is True.
+            Returns a tuple (hash, stale) : (str, bool), where hash is the
+            current hash of the PDF. '''
+        pdf_stat = _stat_pdf(self.paths.pdf_path)
+        old_hash = _read_file(self.paths.hash_path)
+        have_text = os.path.exists(self.paths.text_path)
+        if not have_text and not retry_failed:
+            failure = self.text_failure()
+            have_text = failure is not None and failure[0] == old_hash
+
+        # Fast path: the PDF hasn't been touched since we last hashed it.
+        if (not verify and have_text and old_hash is not None
+                and _read_file(self.paths.stat_path) == pdf_stat):
+            return old_hash, False
+
+        # Metadata from older versions only has an MD5 hash: if it still
+        # matches, switch it over to the new hash without re-extracting.
+        legacy_hash = _read_file(self.paths.legacy_hash_path)
+        if old_hash is None and legacy_hash is not None:
+            current_hash, md5_hash = _hash_pdf(self.paths.pdf_path,
+                                               legacy=True)
+            if have_text and md5_hash == legacy_hash:
+                self._save_hash(current_hash, pdf_stat)
+                os.remove(self.paths.legacy_hash_path)
+                return current_hash, False
+            self._pdf_stat = pdf_stat
+            return current_hash, True
 
-        if os.path.exists(self.paths.hash_path):
-            with open(self.paths.hash_path) as f:
-                old_hash = f.read()
-        else:
-            old_hash = None
+        current_hash = _hash_pdf(self.paths.pdf_path)
 
         # If either the text or hash file is missing, or the old hash doesn't
         # match the current hash, we must reparse the PDF.
-        if (not os.path.exists(self.paths.text_path)
-                or not os.path.exists(self.paths.hash_path)
-                or current_hash != old_hash):
-            new = True
-            text = _parse_pdf_text(self.paths.pdf_path)
-
-            # Save the hash.
-            with open(self.paths.hash_path, 'w') as f:
-                f.write(current_hash)
-
-            # TODO it may be worth saving an indication of failure so as to
-            # avoid reparsing all the time
-            if text is not None:
-                with open(self.paths.text_path, 'w') as f:
-                    f.write(text)
+        stale = not have_text or current_hash != old_hash
+        if stale:
+            self._pdf_stat = pdf_stat
         else:
-            new = False
-            with open(self.paths.text_path) as f:
-                text = f.read()
+            # Only the stat changed (e.g. the PDF was touched or copied), so
+            # record it to take the fast path next time.
+            self._save_hash(current_hash, pdf_stat)
+        return current_hash, stale
+
+    def text_failure(self):
+        ''' Read the record of a failure to extract the text of the PDF.
+            Returns a tuple (hash, extractor, error), or None if there is no
+            such record. '''
+        failure = _read_file(self.paths.failed_path)
+        if failure is None:
+            return None
+        parts = failure.split()
+        if len(parts) != 3:
+            return None
+        return tuple(parts)
+
+    def _save_hash(self, pdf_hash, pdf_stat):
+        ''' Save the hash and stat summary of the PDF. '''
+        os.makedirs(self.paths.metadata_path, exist_ok=True)
+        with open(self.paths.hash_path, 'w') as f:
+            f.write(pdf_hash)
+        with open(self.paths.stat_path, 'w') as f:
+            f.write(pdf_stat)
+
+    def save_text(self, pdf_hash, text, failure=None):
+        ''' Save newly extracted text, along with the hash of the PDF it was
+            extracted from. If extraction failed, text is None and failure is
+            the (extractor, error) tuple returned by _parse_pdf_text; this is
+            recorded so the PDF isn't reparsed until it changes. The stat
+            summary of the PDF is the one taken by text_status, if it found
+            the text to be stale, so that a PDF changed during extraction is
+            hashed again next time. '''
+        pdf_stat = self._pdf_stat
+        if pdf_stat is None:
+            pdf_stat = _stat_pdf(self.paths.pdf_path)
+        self._save_hash(pdf_hash, pdf_stat)
+        for path in (self.paths.legacy_hash_path, self.paths.failed_path,
+                     self.paths.text_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        if text is not None:
+            with open(self.paths.text_path, 'w') as f:
+                f.write(text)
+        elif failure is not None:
+            with open(self.paths.failed_path, 'w') as f:
+                f.write(' '.join((pdf_hash,) + tuple(failure)))
+
+    def cached_hash(self):
+        ''' Read the hash of the PDF the cached text was extracted from, or
+            None if there isn't one. '''
+        return _read_file(self.paths.hash_path)
+
+    def refresh_text(self):
+        ''' Make sure the cached plain text of the PDF file is up to date,
+            re-extracting it if the PDF has changed.
+            Returns a tuple (hash, new) : (str, bool), where hash is the hash
+            of the PDF and new is True if the text was re-extracted. '''
+        current_hash, stale = self.text_status()
+        if stale:
+            text, failure = _parse_pdf_text(self.paths.pdf_path)
+            self.save_text(current_hash, text, failure)
+        return current_hash, stale
+
+    def cached_text(self):
+        ''' Read the cached plain text of the PDF file without checking that it
+            is up to date. Returns None if there is no cached text. '''
+        if not os.path.exists(self.paths.text_path):
+            return None
+        with open(self.paths.text_path) as f:
+            return f.read()
 
-        return text, new
+    def text(self):
+        ''' Retrieve the plain text of the PDF file.
+            Returns a tuple (text, new) : (str, bool)'''
+        _, new = self.refresh_text()
+        return self.cached_text(), new
+
+    def mark_added(self, date_log):
+        ''' Record today as the date the document was added. '''
+        self.load_dates((date_log.add(self.key), None))
 
-    def access(self):
+    def access(self, date_log):
         ''' Update the access date to today. '''
-        self.accessed_date = datetime.date.today()
-        with open(self.paths.accessed_path, 'w') as f:
-            f.write(self.accessed_date.isoformat())
+        self._accessed_date = _parse_date(date_log.access(self.key))
+
+    def matches_metadata(self, tmpl):
+        ''' Returns True if the document matches the patterns supplied for
+            key, title, author, year, venue, entrytype and tags; False
+            otherwise. The text pattern is ignored. '''
+        return bool(tmpl.key(self.key)
+                    and tmpl.title(self.title)
+                    and tmpl.authors(self.authors)
+                    and tmpl.year(self.year)
+                    and tmpl.venue(self.venue)
+                    and tmpl.entrytype(self.entrytype)
+                    and tmpl.tags(self.tags))
 
     def matches(self, tmpl):
         ''' Returns a tuple of the form (result, count). The result is True if
@@ -360,19 +827,7 @@ class ArchivalDocument(object):
             year, and venue; false otherwise. The count is the number of
             matches in the text (this will be 0 if no text pattern is
             supplied). '''
-        if not tmpl.key(self.key):
-            return False, 0
-        if not tmpl.title(self.title):
-            return False, 0
-        if not tmpl.authors(self.authors):
-            return False, 0
-        if not tmpl.year(self.year):
-            return False, 0
-        if not tmpl.venue(self.venue):
-            return False, 0
-        if not tmpl.entrytype(self.entrytype):
-            return False, 0
-        if not tmpl.tags(self.tags):
+        if not self.matches_metadata(tmpl):
             return False, 0
 
         def _text_func():
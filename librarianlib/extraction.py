@@ -0,0 +1,53 @@
+from .document import _parse_pdf_text
+
+
+def stale_docs(docs, verify=False, retry_failed=False):
+    ''' Find the documents whose cached text is out of date. If verify is
+        True, every PDF is hashed rather than trusting unchanged file stats.
+        If retry_failed is True, documents whose text previously failed to be
+        extracted are included even if their PDF hasn't changed.
+        Returns a list of (document, hash) tuples, where hash is the current
+        hash of the PDF. Documents without a PDF are skipped. '''
+    stale = []
+    for doc in docs:
+        try:
+            pdf_hash, is_stale = doc.text_status(verify, retry_failed)
+        except FileNotFoundError:
+            continue
+        if is_stale:
+            stale.append((doc, pdf_hash))
+    return stale
+
+
+def extract_texts(stale, processes=None):
+    ''' Extract the text of the (document, hash) pairs in parallel, using a
+        pool of processes (by default, one per CPU). Each document's text
+        cache is written as soon as its text is available.
+        Yields (document, hash, text, failure) tuples in order of completion,
+        as returned by _parse_pdf_text. '''
+    # Not worth starting a pool for a single document.
+    if len(stale) <= 1 or processes == 1:
+        for doc, pdf_hash in stale:
+            text, failure = _parse_pdf_text(doc.paths.pdf_path)
+            doc.save_text(pdf_hash, text, failure)
+            yield doc, pdf_hash, text, failure
+        return
+
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = {}
+        for doc, pdf_hash in stale:
+            future = pool.submit(_parse_pdf_text, doc.paths.pdf_path)
+            futures[future] = (doc, pdf_hash)
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                doc, pdf_hash = futures[future]
+                text, failure = future.result()
+                doc.save_text(pdf_hash, text, failure)
+                yield doc, pdf_hash, text, failure
+        finally:
+            # Don't leave work queued up if we stop early, e.g. due to an
+            # error or ctrl-c.
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,156 @@
+import os
+import stat
+
+
+def file_stamp(path):
+    ''' Return [mtime_ns, size] of a file, or [0, -1] if it does not exist.
+        If the stamp of a file is unchanged, its contents are assumed to be
+        unchanged too. '''
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [0, -1]
+    return [st.st_mtime_ns, st.st_size]
+
+
+class AtomicFile(object):
+    ''' Context manager for writing a file such that readers (and a crash)
+        only ever see either the old or the new contents. The contents are
+        written to a temporary file, which replaces the original once it has
+        been closed without error. '''
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.tmp_path, 'w')
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+def write_atomic(path, data):
+    ''' Write a string to a file such that readers (and a crash) only ever see
+        either the old or the new contents. '''
+    with AtomicFile(path) as f:
+        f.write(data)
+
+
+def _reflink(src, dest):
+    ''' Clone a file with the FICLONE ioctl, so that both share the same data
+        on disk until either is modified. Only supported on Linux, by
+        copy-on-write filesystems such as btrfs and XFS. Raises OSError if the
+        file can't be cloned. '''
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('Reflinks are not supported on this platform.')
+    # From <linux/fs.h>.
+    ficlone = getattr(fcntl, 'FICLONE', 0x40049409)
+    with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), ficlone, src_file.fileno())
+        except OSError:
+            dest_file.close()
+            os.remove(dest)
+            raise
+
+
+def clone_file(src, dest, link=False):
+    ''' Copy a file as cheaply as the filesystem allows: as a reflink where
+        supported; failing that, as a hard link if link is True (only safe if
+        the source is about to be deleted, since otherwise changes to either
+        file show up in both); and otherwise as a regular copy. '''
+    try:
+        _reflink(src, dest)
+        return
+    except OSError:
+        pass
+    if link and _try_link(src, dest):
+        return
+    _copy_file(src, dest)
+
+
+def _copy_file(src, dest):
+    ''' Copy the contents and permission bits of a file. Where available,
+        copy_file_range is used to copy the data within the kernel, which some
+        filesystems turn into a reflink or a server-side copy. '''
+    import shutil
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+                remaining = os.fstat(src_file.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src_file.fileno(),
+                                                dest_file.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            shutil.copymode(src, dest)
+            return
+        except OSError:
+            pass
+    shutil.copy(src, dest)
+
+
+def _is_exported(src, dest, link):
+    ''' Returns True if dest is already an up to date export of src, as made
+        by export_file. Copies are assumed to be up to date if they have the
+        same size and modification time as the original. '''
+    try:
+        dest_st = os.lstat(dest)
+    except FileNotFoundError:
+        return False
+    if link == 'symbolic':
+        return (stat.S_ISLNK(dest_st.st_mode)
+                and os.readlink(dest) == os.path.abspath(src))
+    if not stat.S_ISREG(dest_st.st_mode):
+        return False
+    src_st = os.stat(src)
+    return (os.path.samestat(src_st, dest_st)
+            or (src_st.st_size == dest_st.st_size
+                and src_st.st_mtime_ns == dest_st.st_mtime_ns))
+
+
+def export_file(src, dest, link=None):
+    ''' Make dest a copy of src, as cheaply as the filesystem allows (see
+        clone_file), or, if link is 'hard' or 'symbolic', a link of that kind
+        to src. A hard link falls back to a copy across filesystems. Nothing
+        is done if dest is already up to date; otherwise it is replaced
+        atomically.
+        Returns True if dest was written. '''
+    if _is_exported(src, dest, link):
+        return False
+
+    tmp_path = dest + '.tmp'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    if link == 'symbolic':
+        os.symlink(os.path.abspath(src), tmp_path)
+    elif link == 'hard' and _try_link(src, tmp_path):
+        pass
+    else:
+        clone_file(src, tmp_path)
+        # Copies take the modification time of the original, so we can tell
+        # that they're up to date next time.
+        src_st = os.stat(src)
+        os.utime(tmp_path, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+    os.replace(tmp_path, dest)
+    return True
+
+
+def _try_link(src, dest):
+    ''' Hard link dest to src. Returns False if that isn't possible, e.g.
+        because they are on different filesystems. '''
+    try:
+        os.link(src, dest)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,129 @@
+import json
+import os
+
+from .document import DocumentPaths, _hash_pdf, _read_file, _stat_pdf
+from .fileops import write_atomic
+
+
+def hash_pdfs(pdf_paths, threads=None):
+    ''' Hash PDFs, in parallel if there are several. Returns a list of the
+        hashes. '''
+    if len(pdf_paths) <= 1:
+        return [_hash_pdf(path) for path in pdf_paths]
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(_hash_pdf, pdf_paths))
+
+
+def _pdf_stat(paths):
+    ''' Summarize the stat of the PDF of a document, in the format of the
+        stat file in the text cache, or return None if there is no PDF. '''
+    try:
+        return _stat_pdf(paths.pdf_path)
+    except FileNotFoundError:
+        return None
+
+
+class HashIndex(object):
+    ''' Index of the hash of the PDF of every document in the archive, stored
+        as a JSON file mapping each key to the stat summary of its PDF and its
+        hash.
+        Hashes are taken from the text cache if it's up to date with the PDF,
+        so a PDF is only hashed here if its text has never been extracted. '''
+    def __init__(self, path, archive_path):
+        self.path = path
+        self.archive_path = archive_path
+        self._entries = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries=None):
+        ''' Write the index to disk. The index is only a cache, so failure to
+            write it is ignored. '''
+        if entries is None:
+            entries = self._entries
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(entries))
+        except OSError:
+            pass
+
+    def load(self, threads=None):
+        ''' Return a dictionary mapping every key in the archive to the hash of
+            its PDF, bringing the index up to date first. '''
+        if self._entries is not None:
+            return {key: entry[1] for key, entry in self._entries.items()}
+
+        cached = self._read()
+        entries = {}
+        unhashed = []
+        with os.scandir(self.archive_path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                key = entry.name
+                paths = DocumentPaths(self.archive_path, key)
+                stat = _pdf_stat(paths)
+                if stat is None:
+                    continue
+                if key in cached and cached[key][0] == stat:
+                    entries[key] = cached[key]
+                elif (_read_file(paths.stat_path) == stat
+                        and os.path.exists(paths.hash_path)):
+                    entries[key] = [stat, _read_file(paths.hash_path)]
+                else:
+                    unhashed.append((key, paths, stat))
+
+        pdf_paths = [paths.pdf_path for _, paths, _ in unhashed]
+        for (key, _, stat), pdf_hash in zip(unhashed,
+                                            hash_pdfs(pdf_paths, threads)):
+            entries[key] = [stat, pdf_hash]
+
+        self._entries = entries
+        if entries != cached:
+            self._write()
+        return {key: entry[1] for key, entry in entries.items()}
+
+    def keys_by_hash(self):
+        ''' Return a dictionary mapping each hash to the list of keys of the
+            documents whose PDF has it. '''
+        keys = {}
+        for key, pdf_hash in sorted(self.load().items()):
+            keys.setdefault(pdf_hash, []).append(key)
+        return keys
+
+    def duplicates(self):
+        ''' Return a list of the groups of keys of documents with identical
+            PDFs. '''
+        return [keys for keys in self.keys_by_hash().values()
+                if len(keys) > 1]
+
+    def update(self, hashes):
+        ''' Record the hashes of the PDFs of documents that have just been
+            added or changed, given as a dictionary mapping key to hash. '''
+        self.load()
+        for key, pdf_hash in hashes.items():
+            stat = _pdf_stat(DocumentPaths(self.archive_path, key))
+            if stat is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = [stat, pdf_hash]
+        self._write()
+
+    def rename_keys(self, renames):
+        ''' Move the entries of rekeyed documents, given as (old_key, new_key)
+            pairs, to their new keys. Renaming a PDF doesn't change its stat,
+            so it needn't be hashed again. '''
+        entries = self._entries
+        if entries is None:
+            # The entries on disk are only trusted once load has checked them.
+            entries = self._read()
+        for old_key, new_key in renames:
+            if old_key in entries:
+                entries[new_key] = entries.pop(old_key)
+        self._write(entries)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+
+from .exceptions import LibraryException
+from .fileops import write_atomic
+
+
+# Bump this whenever the format of the generated files changes, so that every
+# file is rewritten.
+INDEX_VERSION = 1
+
+# Documents are spread over shards by a hash of their key, so that adding or
+# changing a document only changes the one shard it's in. The number of shards
+# doubles as the library grows past this many documents per shard.
+DOCS_PER_SHARD = 256
+
+MANIFEST_NAME = 'manifest.json'
+DATA_DIR_NAME = 'data'
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Library</title>
+<style>
+body {{ font-family: sans-serif; max-width: 60em; margin: 2em auto; }}
+#search {{ width: 100%; font-size: 1.2em; }}
+#list li {{ margin: 0.8em 0; }}
+.meta {{ color: #555; }}
+.tags {{ color: #a60; }}
+</style>
+</head>
+<body>
+<input id="search" type="search" placeholder="Search titles, authors, keys, venues and tags">
+<p id="status"></p>
+<ul id="list"></ul>
+<p><button id="prev">Previous</button> <button id="next">Next</button></p>
+<script>var LIBRARY_INDEX = [];</script>
+{shards}
+<script>
+(function() {{
+  var PAGE_SIZE = 100;
+  var docs = [].concat.apply([], LIBRARY_INDEX);
+  docs.forEach(function(doc) {{
+    doc.haystack = [doc[0], doc[1], doc[2].join(' '), doc[3], doc[4] || '',
+                    doc[6].join(' ')].join(' ').toLowerCase();
+  }});
+  // Most recent first.
+  docs.sort(function(a, b) {{
+    return b[3].localeCompare(a[3]) || a[0].localeCompare(b[0]);
+  }});
+
+  var search = document.getElementById('search');
+  var status = document.getElementById('status');
+  var list = document.getElementById('list');
+  var prev = document.getElementById('prev');
+  var next = document.getElementById('next');
+  var matches = docs;
+  var page = 0;
+
+  function element(tag, className, text) {{
+    var el = document.createElement(tag);
+    if (className) el.className = className;
+    if (text) el.textContent = text;
+    return el;
+  }}
+
+  function render() {{
+    var pages = Math.max(1, Math.ceil(matches.length / PAGE_SIZE));
+    list.textContent = '';
+    matches.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).forEach(
+        function(doc) {{
+      var item = element('li');
+      var link = element('a', null, doc[1]);
+      link.href = doc[8];
+      item.appendChild(link);
+      item.appendChild(element('div', 'meta',
+          doc[3] + ' (' + doc[0] + ') ' + doc[2].join('; ')));
+      if (doc[4]) item.appendChild(element('div', 'meta', doc[4]));
+      if (doc[6].length) {{
+        item.appendChild(element('div', 'tags', doc[6].join(', ')));
+      }}
+      list.appendChild(item);
+    }});
+    status.textContent = matches.length + ' documents, page ' + (page + 1) +
+        ' of ' + pages;
+    prev.disabled = page === 0;
+    next.disabled = page >= pages - 1;
+  }}
+
+  search.addEventListener('input', function() {{
+    var terms = search.value.toLowerCase().split(/\\s+/).filter(Boolean);
+    matches = docs.filter(function(doc) {{
+      return terms.every(function(term) {{
+        return doc.haystack.indexOf(term) >= 0;
+      }});
+    }});
+    page = 0;
+    render();
+  }});
+  prev.addEventListener('click', function() {{ page--; render(); }});
+  next.addEventListener('click', function() {{ page++; render(); }});
+  render();
+}})();
+</script>
+</body>
+</html>
+'''
+
+
+def _shard_count(num_docs):
+    ''' Number of shards to spread the documents over. '''
+    count = 1
+    while count * DOCS_PER_SHARD < num_docs:
+        count *= 2
+    return count
+
+
+def _shard_of(key, count):
+    ''' Shard a document belongs in. Unlike hash(), this is the same in every
+        run. '''
+    digest = hashlib.blake2b(key.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def _shard_name(shard):
+    return '{}/shard-{:04d}.js'.format(DATA_DIR_NAME, shard)
+
+
+def _doc_entry(doc, output_path):
+    ''' Summary of a document for the index. Returns None if the document's
+        metadata can't be read. '''
+    try:
+        return [doc.key, doc.title, doc.authors, doc.year, doc.venue,
+                doc.entrytype, doc.tags, doc.added_date.strftime('%Y-%m-%d'),
+                os.path.relpath(doc.paths.pdf_path,
+                                output_path).replace(os.sep, '/')]
+    except LibraryException:
+        return None
+
+
+def _read_manifest(path):
+    ''' Read the digests of the files last written, or an empty dictionary if
+        they are unknown. '''
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != INDEX_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def write_index(docs, output_path):
+    ''' Write a static HTML index of the documents to a directory. The page
+        loads the documents from shards of JavaScript data (which, unlike
+        JSON, can be loaded from a file:// URL) and searches and paginates
+        them in the browser. Only the files whose contents have changed since
+        the last time are rewritten.
+        Returns a tuple (written, total) of the number of files written and
+        the total number of files in the index. '''
+    entries = [entry for entry in (_doc_entry(doc, output_path)
+                                   for doc in docs)
+               if entry is not None]
+    count = _shard_count(len(entries))
+    shards = [[] for _ in range(count)]
+    for entry in sorted(entries):
+        shards[_shard_of(entry[0], count)].append(entry)
+
+    contents = {}
+    for shard, shard_entries in enumerate(shards):
+        contents[_shard_name(shard)] = 'LIBRARY_INDEX.push({});\n'.format(
+                json.dumps(shard_entries))
+    scripts = '\n'.join('<script src="{}"></script>'.format(name)
+                        for name in sorted(contents))
+    contents['index.html'] = PAGE_TEMPLATE.format(shards=scripts)
+
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    old_digests = _read_manifest(manifest_path)
+    digests = {}
+    written = 0
+    os.makedirs(os.path.join(output_path, DATA_DIR_NAME), exist_ok=True)
+    for name, content in sorted(contents.items()):
+        digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        digests[name] = digest
+        path = os.path.join(output_path, name)
+        if old_digests.get(name) == digest and os.path.exists(path):
+            continue
+        write_atomic(path, content)
+        written += 1
+
+    # Remove shards left over from when there were more of them.
+    for name in set(old_digests).difference(digests):
+        try:
+            os.remove(os.path.join(output_path, name))
+        except FileNotFoundError:
+            pass
+
+    write_atomic(manifest_path, json.dumps({'version': INDEX_VERSION,
+                                            'files': digests}))
+    return written, len(contents)
@@ -0,0 +1,107 @@
+import json
+import os
+
+from .fileops import write_atomic
+
+
+def link_key(target):
+    ''' Key of the document a link into the archive points to, which is the
+        name of the document's directory. '''
+    return os.path.basename(target.rstrip(os.sep))
+
+
+def find_links(directory, recursive=False):
+    ''' Find the symlinks in a directory, and in its subdirectories if
+        recursive is True. Symlinks to directories are never followed.
+        Yields (path, target) tuples. '''
+    stack = [directory]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with it:
+            for entry in it:
+                if entry.is_symlink():
+                    yield entry.path, os.readlink(entry.path)
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+
+def replace_link(target, path):
+    ''' Point a symlink at a new target. The new link is created beside the
+        old one and renamed over it, so there is never a moment without a
+        link. '''
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    os.symlink(target, tmp_path)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+class LinkRegistry(object):
+    ''' Record of the symlinks created into the archive, stored as a JSON
+        file mapping each link to the key it points to, so that links can be
+        found again without walking any directory trees. Links inside the
+        library are recorded relative to it, so that the registry stays valid
+        when the whole library is moved. '''
+    def __init__(self, path, library_path):
+        self.path = path
+        self.library_path = library_path
+        self._links = None
+
+    def _name(self, path):
+        path = os.path.abspath(path)
+        relpath = os.path.relpath(path, self.library_path)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return path
+        return relpath
+
+    def _load(self):
+        if self._links is None:
+            try:
+                with open(self.path) as f:
+                    self._links = json.load(f)
+            except (OSError, ValueError):
+                self._links = {}
+        return self._links
+
+    def _write(self):
+        ''' Write the registry to disk. It only saves walking the shelves, so
+            failure to write it is ignored. '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(self._links, indent=0,
+                                               sort_keys=True))
+        except OSError:
+            pass
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def links(self):
+        ''' Return a dictionary mapping the absolute path of each registered
+            link to its key. '''
+        return {os.path.join(self.library_path, name): key
+                for name, key in self._load().items()}
+
+    def links_to(self, keys):
+        ''' Return a dictionary mapping the absolute path of each registered
+            link to one of the given keys to its key. '''
+        keys = set(keys)
+        return {path: key for path, key in self.links().items()
+                if key in keys}
+
+    def update(self, links, removed=()):
+        ''' Record links, given as a dictionary mapping path to key, and
+            forget the links at the paths in removed. '''
+        entries = self._load()
+        old = dict(entries)
+        for path in removed:
+            entries.pop(self._name(path), None)
+        for path, key in links.items():
+            entries[self._name(path)] = key
+        if entries != old:
+            self._write()
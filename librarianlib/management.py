@@ -1,29 +1,41 @@
 # Built-in.
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
 import os
+import re
 import shutil
-import yaml
-
-# Third party.
-import bibtexparser
-from bibtexparser.bwriter import BibTexWriter
-import pyparsing
+import sqlite3
+import unicodedata
 
 # Ours.
-from .document import DocumentPaths, ArchivalDocument, DocumentTemplate
+from . import completion, htmlindex
+from .batch import PendingDocument, check_pending, find_pairs, read_bib
+from .catalog import Catalog
+from .config import (CACHE_DIR_NAME, DATE_LOG_NAME, find_config,
+                     read_library_path)
+from .datelog import DateLog
+from .document import (DATE_FORMAT, DocumentPaths, ArchivalDocument,
+                       DocumentTemplate)
 from .exceptions import LibraryException
-
-
-def _find_config(search_dirs, config_name):
-    ''' Find the path to the configuration file. '''
-    for search_dir in search_dirs:
-        path = os.path.join(search_dir, config_name)
-        if os.path.exists(path):
-            return path
-    return None
+from .extraction import stale_docs, extract_texts
+from .fileops import (AtomicFile, clone_file, export_file, file_stamp,
+                      write_atomic)
+from .hashindex import HashIndex
+from .links import LinkRegistry, find_links, link_key, replace_link
+from .query import And, Query, Term, parse as parse_query
+from .rekey import RekeyJournal, set_bibtex_key
+from .tagindex import TagIndex
+from .textindex import TextIndex
 
 
 def _key_from_bibtex(bib_path):
     ''' Extract the document key from a bibtex file. '''
+    import bibtexparser
+    import pyparsing
+
     with open(bib_path) as bib_file:
         try:
             bib_info = bibtexparser.load(bib_file)
@@ -37,34 +49,208 @@ def _key_from_bibtex(bib_path):
     return keys[0]
 
 
+# Sort orders that need the dates documents were added and opened.
+DATE_SORTS = ('added', 'accessed', 'recent')
+
+
+def _sort_key(sort):
+    ''' Return a function giving the key by which to sort a (document, count)
+        search result. '''
+    def _doc_sort_key(doc_count_tuple):
+        doc, count = doc_count_tuple
+
+        if sort == 'key':
+            return doc.key
+        if sort == 'title':
+            return doc.title.lower()
+        if sort == 'year':
+            return doc.year
+        if sort == 'added':
+            return doc.added_date
+        if sort == 'accessed' or sort == 'recent':
+            return doc.accessed_date
+        if sort == 'matches':
+            return count
+        return doc.year
+    return _doc_sort_key
+
+
+# Titles at least this similar, as measured by difflib, are considered to be
+# of the same document.
+SIMILAR_TITLE_RATIO = 0.9
+
+
+def _normalize(s):
+    ''' Reduce a string to lowercase ASCII words, so that differences in
+        accents, case and punctuation are ignored. '''
+    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode()
+    return ' '.join(re.findall(r'[a-z0-9]+', s.lower()))
+
+
+def _similar_groups(docs):
+    ''' Find groups of documents whose titles are similar and whose first
+        authors have the same surname. Returns a list of lists of keys. '''
+    import difflib
+
+    # Only documents whose first authors share a surname are compared.
+    buckets = {}
+    for doc in docs:
+        try:
+            title, authors = doc.title, doc.authors
+        except LibraryException:
+            continue
+        names = _normalize(authors[0]).split() if authors else []
+        surname = names[-1] if names else ''
+        buckets.setdefault(surname, []).append((doc.key, _normalize(title)))
+
+    groups = []
+    for entries in buckets.values():
+        # Merge similar pairs into groups, with each entry pointing to the
+        # first entry of its group.
+        group_of = list(range(len(entries)))
+        for i in range(len(entries)):
+            matcher = difflib.SequenceMatcher(None, entries[i][1])
+            for j in range(i + 1, len(entries)):
+                if group_of[j] == group_of[i]:
+                    continue
+                matcher.set_seq2(entries[j][1])
+                # The quick ratios are upper bounds, so most pairs are
+                # ruled out without computing the real one.
+                if (matcher.real_quick_ratio() >= SIMILAR_TITLE_RATIO
+                        and matcher.quick_ratio() >= SIMILAR_TITLE_RATIO
+                        and matcher.ratio() >= SIMILAR_TITLE_RATIO):
+                    old, new = group_of[j], group_of[i]
+                    group_of = [new if g == old else g for g in group_of]
+
+        members = {}
+        for (key, _), group in zip(entries, group_of):
+            members.setdefault(group, []).append(key)
+        groups.extend(sorted(keys) for keys in members.values()
+                      if len(keys) > 1)
+    return sorted(groups)
+
+
 class LibraryManager(object):
     ''' Manager for the library. Handles all interactions with it. '''
     def __init__(self, search_dirs, config_name):
-        config_file_path = _find_config(search_dirs, config_name)
+        config_file_path = find_config(search_dirs, config_name)
         if config_file_path is None:
             raise LibraryException('Could not find config file.')
 
-        with open(config_file_path) as f:
-            config = yaml.load(f)
+        # Most commands only need the library path, which can be read without
+        # loading a YAML parser.
+        self.config_file_path = config_file_path
+        self._config = None
+        library_path = read_library_path(config_file_path)
+        if library_path is None:
+            library_path = self.config['library']
 
-        self.path = os.path.expanduser(config['library'])
+        self.path = os.path.expanduser(library_path)
         self.archive_path = os.path.join(self.path, 'archive')
+        self.shelves_path = os.path.join(self.path, 'shelves')
+        self.bookmarks_path = os.path.join(self.path, 'bookmarks')
+        self._date_log = DateLog(os.path.join(self.path, DATE_LOG_NAME))
+
+        # Caches and indexes maintained by the tool itself live here.
+        self.cache_path = os.path.join(self.path, CACHE_DIR_NAME)
+        self.catalog = Catalog(os.path.join(self.cache_path, 'catalog.db'))
+        self.text_index = TextIndex(os.path.join(self.cache_path, 'text.db'))
+        self.tag_index = TagIndex(os.path.join(self.cache_path, 'tags.json'),
+                                  self.archive_path)
+        self.hash_index = HashIndex(
+                os.path.join(self.cache_path, 'hashes.json'), self.archive_path)
+        self.link_registry = LinkRegistry(
+                os.path.join(self.cache_path, 'links.json'), self.path)
+        self.rekey_journal = RekeyJournal(
+                os.path.join(self.cache_path, 'rekey.journal'),
+                self.archive_path)
 
         # Check that the archive exists.
         if not os.path.isdir(self.archive_path):
             msg = '{} does not exist!'.format(self.archive_path)
             raise LibraryException(msg)
 
+        # Finish off a rekey that was interrupted.
+        if self.rekey_journal.exists():
+            self._finish_rekey()
+
+    @property
+    def config(self):
+        ''' The full configuration, parsed on first use. '''
+        if self._config is None:
+            import yaml
+            with open(self.config_file_path) as f:
+                self._config = yaml.safe_load(f)
+        return self._config
+
+    def _legacy_dates(self):
+        ''' Return a dictionary mapping each key to the (added, accessed)
+            dates recorded in the document's own files, as they were before
+            there was a date log. '''
+        dates = {}
+        for key in self.all_keys():
+            doc = ArchivalDocument(key, DocumentPaths(self.archive_path, key))
+            try:
+                dates[key] = doc.legacy_dates()
+            except OSError:
+                continue
+        return dates
+
+    @property
+    def date_log(self):
+        ''' Log of the dates documents were added and opened, for recording
+            new dates. If there is no log yet, it is first started with the
+            dates recorded in each document's own files. Reading dates doesn't
+            need this: until the log exists, documents read their dates from
+            their own files. '''
+        if not self._date_log.exists():
+            try:
+                self._date_log.record_all(self._legacy_dates())
+            except OSError:
+                # The documents' dates are read from their own files until the
+                # log can be written.
+                pass
+        return self._date_log
+
+    def _load_dates(self, docs):
+        ''' Fill in the dates of the documents from the date log. '''
+        dates = self._date_log.dates()
+        for doc in docs:
+            doc.load_dates(dates.get(doc.key))
+
+    def _with_dates(self, results):
+        ''' Yield (document, count) search results with the dates of the
+            documents filled in from the date log. '''
+        dates = self._date_log.dates()
+        for doc, count in results:
+            doc.load_dates(dates.get(doc.key))
+            yield doc, count
+
+    def _opened_keys(self, days):
+        ''' Return the set of keys of the documents opened within the last
+            number of days. '''
+        since = datetime.date.today() - datetime.timedelta(days=days)
+        since = since.strftime(DATE_FORMAT)
+        if not self._date_log.exists():
+            return {key for key, (_, accessed) in self._legacy_dates().items()
+                    if accessed is not None and accessed >= since}
+        return self._date_log.opened_since(since)
+
+    @property
+    def processes(self):
+        ''' Number of processes used to extract text from PDFs. None means one
+            per CPU. '''
+        return self.config.get('processes')
+
     def has_key(self, key):
         ''' Returns True if the key is in the archive, false otherwise. '''
         return os.path.isdir(os.path.join(self.archive_path, key))
 
     def all_docs(self):
-        ''' Return all documents in the library. '''
-        docs = []
-        for key in os.listdir(self.archive_path):
-            paths = DocumentPaths(self.archive_path, key)
-            docs.append(ArchivalDocument(key, paths))
+        ''' Return all documents in the library. Only documents that have
+            changed since they were last cataloged are parsed from disk. '''
+        docs = self.catalog.documents(self.archive_path, self.all_keys())
+        self._load_dates(docs)
         return docs
 
     def all_keys(self):
@@ -77,58 +263,211 @@ class LibraryManager(object):
         if not self.has_key(key):
             raise Exception('Key {} not found in archive.'.format(key))
         paths = DocumentPaths(self.archive_path, key)
-        return ArchivalDocument(key, paths)
-
-    def add(self, pdf_src_path, bib_src_path):
-        ''' Add a new document to the archive. Returns the document. '''
-        key = _key_from_bibtex(bib_src_path)
-
-        if self.has_key(key):
-            msg = 'Archive already contains key {}. Aborting.'.format(key)
-            raise LibraryException(msg)
-
-        # Create document structure.
-        paths = DocumentPaths(self.archive_path, key)
+        doc = ArchivalDocument(key, paths)
+        self._load_dates([doc])
+        return doc
+
+    def add(self, pdf_src_path, bib_src_path, allow_duplicates=False,
+            warn=None):
+        ''' Add a new document to the archive. Returns the document. See
+            add_batch for the other parameters. '''
+        bibtex, bibtex_str = read_bib(bib_src_path)
+        pending = PendingDocument(pdf_src_path, bib_src_path, bibtex,
+                                  bibtex_str)
+        return self.add_batch([pending], allow_duplicates=allow_duplicates,
+                              warn=warn)[0]
+
+    def _archive_pending(self, item, tags, link):
+        ''' Create the document for a PendingDocument in the archive. '''
+        paths = DocumentPaths(self.archive_path, item.key)
         os.mkdir(paths.key_path)
         os.mkdir(paths.metadata_path)
-        shutil.copy(pdf_src_path, paths.pdf_path)
-        shutil.copy(bib_src_path, paths.bib_path)
+        clone_file(item.pdf_path, paths.pdf_path, link)
+        clone_file(item.bib_path, paths.bib_path, link)
+
+        doc = ArchivalDocument(item.key, paths)
+        doc.load_bibtex(item.bibtex, item.bibtex_str)
+        doc.mark_added(self.date_log)
+        if tags:
+            doc.tag(tags)
+        return doc
+
+    def add_batch(self, pending, tags=None, link=False, threads=None,
+                  problems=None, allow_duplicates=False, warn=None):
+        ''' Add a batch of documents to the archive. Nothing is written unless
+            every document can be added: each key must be new and used only
+            once, and unless allow_duplicates is True, no PDF may be a
+            duplicate of another in the batch or of one already in the
+            archive.
+            Params:
+                pending - List of PendingDocuments, e.g. from find_pairs.
+                tags - Tags to apply to every document.
+                link - Hard link files into the archive when they can't be
+                       reflinked, rather than copying them. Only safe if the
+                       originals are deleted afterwards.
+                threads - Number of threads used to hash and copy the files.
+                problems - Problems already found with the batch, which are
+                           reported along with any others.
+                allow_duplicates - Add duplicate PDFs anyway.
+                warn - Optional function called with a message describing
+                       each duplicate that is allowed.
+            Returns:
+                The list of new documents. '''
+        problems = list(problems) if problems else []
+        collisions, duplicates = check_pending(
+                pending, self.has_key, self.hash_index.keys_by_hash(), threads)
+        problems.extend(collisions)
+        if allow_duplicates:
+            for message in duplicates:
+                if warn:
+                    warn(message)
+        else:
+            problems.extend(duplicates)
+        if problems:
+            raise LibraryException('\n'.join(problems + ['Aborting.']))
 
-        return ArchivalDocument(key, paths)
+        try:
+            if len(pending) <= 1:
+                docs = [self._archive_pending(item, tags, link)
+                        for item in pending]
+            else:
+                import concurrent.futures
+                with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+                    docs = list(pool.map(
+                        lambda item: self._archive_pending(item, tags, link),
+                        pending))
+        except:
+            # Don't leave part of the batch behind.
+            for item in pending:
+                shutil.rmtree(os.path.join(self.archive_path, item.key),
+                              ignore_errors=True)
+            raise
+
+        # The bibtex has already been parsed, so catalog the documents now
+        # rather than parse it again later.
+        docs = list(self.catalog.fill(docs))
+        self.hash_index.update({item.key: item.pdf_hash for item in pending})
+        completion.update_keys(self.cache_path, self.archive_path)
+        return docs
 
-    def rekey(self, old_key, new_key):
-        ''' Change the key of an existing document in the archive. '''
-        old_paths = self.get_doc(old_key).paths
+    def add_directory(self, directory, tags=None, link=False, threads=None,
+                      allow_duplicates=False, warn=None):
+        ''' Add every pair of PDF and bibtex files found under a directory to
+            the archive, as a single batch. See add_batch. Returns the list of
+            new documents. '''
+        pending, problems = find_pairs(directory)
+        return self.add_batch(pending, tags, link, threads, problems,
+                              allow_duplicates, warn)
 
-        # If a new key has not been supplied, we take the key from the bibtex
-        # file.
+    def rekey(self, old_key, new_key):
+        ''' Change the key of an existing document in the archive. If a new
+            key is not given, it is taken from the bibtex file. Returns the
+            new key. '''
         if new_key is None:
-            new_key = _key_from_bibtex(old_paths.bib_path)
-
-        if self.has_key(new_key):
-            msg = 'Archive already contains key {}. Aborting.'.format(new_key)
-            raise LibraryException(msg)
-
-        new_paths = DocumentPaths(self.archive_path, new_key)
-
-        # Rename PDF and bibtex file and then rename the whole directory.
-        shutil.move(old_paths.bib_path,
-                    os.path.join(old_paths.key_path, new_key + '.bib'))
-        shutil.move(old_paths.pdf_path,
-                    os.path.join(old_paths.key_path, new_key + '.pdf'))
-        shutil.move(old_paths.key_path, new_paths.key_path)
-
-        # Write the new_key to the bibtex file
-        with open(new_paths.bib_path, 'r') as f:
-            bib_info = bibtexparser.load(f)
-
-        bib_info.entries[0]['ID'] = new_key
-        bib_writer = BibTexWriter()
-        with open(new_paths.bib_path, 'w') as f:
-            f.write(bib_writer.write(bib_info))
-
+            if not self.has_key(old_key):
+                msg = 'Key {} not found in archive.'.format(old_key)
+                raise LibraryException(msg)
+            new_key = _key_from_bibtex(
+                    DocumentPaths(self.archive_path, old_key).bib_path)
+        self.rekey_batch([(old_key, new_key)])
         return new_key
 
+    def bibtex_renames(self):
+        ''' Find the documents whose bibtex has a different key from the one
+            they are archived under. Returns a list of (key, bibtex key)
+            pairs. '''
+        renames = []
+        for doc in self.all_docs():
+            try:
+                bibtex_key = doc.bibtex['ID']
+            except LibraryException:
+                continue
+            if bibtex_key != doc.key:
+                renames.append((doc.key, bibtex_key))
+        return renames
+
+    def rekey_batch(self, renames):
+        ''' Change the keys of documents, given as a list of (old_key,
+            new_key) pairs, as a single transaction: if anything goes wrong,
+            every document is left with its old key. The bibtex of each
+            document is updated with its new key, and the catalog and indexes
+            and any links to the documents are moved over to the new keys. '''
+        problems = []
+        new_keys = set()
+        old_keys = set(old_key for old_key, _ in renames)
+        for old_key, new_key in renames:
+            if not self.has_key(old_key):
+                problems.append('Key {} not found in archive.'.format(old_key))
+            if (not new_key or os.sep in new_key
+                    or new_key in (os.curdir, os.pardir)):
+                problems.append('Invalid key {}.'.format(new_key))
+            elif (self.has_key(new_key) or new_key in old_keys
+                    or new_key in new_keys):
+                problems.append('Archive already contains key {}.'.format(
+                    new_key))
+            new_keys.add(new_key)
+        if problems:
+            raise LibraryException('\n'.join(problems + ['Aborting.']))
+
+        # Read and update every bibtex file before touching anything.
+        bibtex_strs = []
+        for old_key, new_key in renames:
+            doc = self.get_doc(old_key)
+            bibtex_strs.append(set_bibtex_key(doc.bibtex_str + '\n', old_key,
+                                              new_key, doc.bibtex.get('ID')))
+
+        # Make sure the links to the documents can be found afterwards.
+        if not self.link_registry.exists():
+            self._register_links()
+
+        renames = [list(pair) for pair in renames]
+        self.rekey_journal.begin(renames)
+        try:
+            for (old_key, new_key), bibtex_str in zip(renames, bibtex_strs):
+                self.rekey_journal.rename(old_key, new_key, bibtex_str)
+        except BaseException:
+            self.rekey_journal.rollback(renames)
+            self.rekey_journal.remove()
+            raise
+        self.rekey_journal.commit(renames)
+        self._finish_rekey()
+
+    def _finish_rekey(self):
+        ''' Complete or undo the rekeying recorded in the journal, if there is
+            one, depending on whether it was committed. Everything done here
+            is safe to repeat, if we're interrupted again. '''
+        journal = self.rekey_journal.read()
+        if journal is None:
+            return
+        renames, committed = journal
+        if not committed:
+            self.rekey_journal.rollback(renames)
+            self.rekey_journal.remove()
+            return
+
+        self.rekey_journal.clean_up(renames)
+        self.catalog.rename_keys(self.archive_path, renames)
+        self.tag_index.rename_keys(renames)
+        self.hash_index.rename_keys(renames)
+        self._date_log.rename_keys(renames)
+        try:
+            self.text_index.rename_keys(renames)
+        except (OSError, sqlite3.Error):
+            pass
+
+        # Point links at the new keys.
+        new_keys = dict(renames)
+        links = {}
+        for path, old_key in self.link_registry.links_to(new_keys).items():
+            if os.path.islink(path):
+                replace_link(os.path.join(self.archive_path,
+                                          new_keys[old_key]), path)
+                links[path] = new_keys[old_key]
+        self.link_registry.update(links)
+
+        completion.update_keys(self.cache_path, self.archive_path)
+        self.rekey_journal.remove()
+
     def link(self, key, path):
         ''' Create a symlink to a document in the archive. '''
         path = path if path is not None else key
@@ -145,43 +484,102 @@ class LibraryManager(object):
             raise LibraryException(msg)
 
         os.symlink(src, dest)
+        self.link_registry.update({dest: key})
+
+    def bookmark(self, key, name=None):
+        ''' Create a symlink to a document in the bookmarks directory, named
+            after its key unless a name is given. '''
+        os.makedirs(self.bookmarks_path, exist_ok=True)
+        self.link(key, os.path.join(self.bookmarks_path, name or key))
+
+    def _relink(self, links):
+        ''' Point links at the current location of the documents they link
+            to, e.g. after the library has been moved. Links are given as a
+            dictionary mapping path to current target, and are recorded in
+            the link registry.
+            Returns a tuple (fixed, missing) of the lists of paths of the
+            links that were changed and of the links to documents that aren't
+            in the archive. '''
+        keys = set(self.all_keys())
+        fixed = []
+        missing = []
+        found = {}
+        for path, target in sorted(links.items()):
+            key = link_key(target)
+            if key not in keys:
+                missing.append(path)
+                continue
+            found[path] = key
+            src = os.path.join(self.archive_path, key)
+            if target != src:
+                replace_link(src, path)
+                fixed.append(path)
+        self.link_registry.update(found)
+        return fixed, missing
+
+    def _register_links(self):
+        ''' Record the links into the archive in the shelves and bookmarks in
+            the link registry, e.g. for links created before there was one. '''
+        keys = set(self.all_keys())
+        links = {}
+        for directory in (self.shelves_path, self.bookmarks_path):
+            for path, target in find_links(directory, recursive=True):
+                if link_key(target) in keys:
+                    links[path] = link_key(target)
+        self.link_registry.update(links)
 
     def fix_link(self, link):
         ''' Fix a link that has broken due to the library being moved. '''
         if not os.path.islink(link):
             raise LibraryException('{} is not a symlink.'.format(link))
 
-        key = os.path.basename(os.readlink(link))
-
-        if not self.has_key(key):
-            msg = 'No document with key {} is in the archive.'.format(link)
+        target = os.readlink(link)
+        _, missing = self._relink({link: target})
+        if missing:
+            msg = 'No document with key {} is in the archive.'.format(
+                    link_key(target))
             raise LibraryException(msg)
 
-        # Recreate the link, pointing to the correct location.
-        os.remove(link)
-        self.link(key, link)
-
-    def fix_links(self, directory):
-        ''' Fix all broken links in the directory. '''
-        files = os.listdir(directory)
-        for link in filter(os.path.islink, files):
-            self.fix_link(link)
+    def fix_links(self, *directories, recursive=False):
+        ''' Fix all broken links in the directories, and in their
+            subdirectories if recursive is True. See _relink for the return
+            value. '''
+        links = {}
+        for directory in directories:
+            links.update(find_links(directory, recursive))
+        return self._relink(links)
+
+    def fix_registered_links(self):
+        ''' Fix all the links in the link registry, without searching for
+            them. Links that no longer exist are dropped from the registry.
+            See _relink for the return value. '''
+        links = {}
+        removed = []
+        for path in self.link_registry.links():
+            try:
+                links[path] = os.readlink(path)
+            except OSError:
+                removed.append(path)
+        self.link_registry.update({}, removed)
+        return self._relink(links)
 
     def tag(self, key, tags):
         ''' Apply one or more tags to a document.
             Params:
                 key - Key for document to tag.
-                tags - Comma-separated string of tags.
+                tags - A single tag, or a list of tags.
             Returns:
                 None '''
-        self.get_doc(key).tag(tags)
+        doc = self.get_doc(key)
+        doc.tag(tags)
+        self.tag_index.update(doc)
 
     def get_tags(self):
         ''' Get a list of (tag, count) tuples, ordered from most to least
             frequent. '''
         tag_count_map = {}
-        for doc in self.all_docs():
-            for tag in doc.tags:
+        for tags in self.tag_index.load().values():
+            for tag in tags:
                 if tag in tag_count_map:
                     tag_count_map[tag] += 1
                 else:
@@ -197,48 +595,281 @@ class LibraryManager(object):
                 new_tag - New tag name.
             Returns:
                 None '''
-        for doc in self.all_docs():
-            doc.rename_tag(current_tag, new_tag)
+        self.tag_index.rename(current_tag, new_tag)
+
+    def find_duplicates(self):
+        ''' Find documents that are likely to be duplicates of each other.
+            Returns a tuple (identical, similar) of lists of groups of keys:
+            those of documents with identical PDFs, according to the hash
+            index, and those of documents with similar titles and the same
+            first author. '''
+        identical = sorted(self.hash_index.duplicates())
+        similar = _similar_groups(self.all_docs())
+        return identical, similar
+
+    def _manifest_path(self, path):
+        ''' Path of the manifest recording what was last compiled to a
+            file. '''
+        name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.cache_path, 'compile', name + '.json')
+
+    def compile_bibtex(self, path, incremental=False, progress=None,
+                       **filters):
+        ''' Write the bibtex of every document matching the filters, which are
+            those of search_docs, to a single file. Entries are written in
+            order of key, one at a time, so that the whole bibliography is
+            never held in memory. If incremental is True, the file is left as
+            it is if neither it, the documents matching the filters, nor any of
+            their bibtex files have changed since it was last compiled with the
+            same filters.
+            Returns the number of entries written, or None if the file was
+            already up to date. '''
+        keys = sorted(doc.key for doc, _ in
+                      self.search_docs(progress=progress, **filters))
+        entries = []
+        for key in keys:
+            bib_path = DocumentPaths(self.archive_path, key).bib_path
+            entries.append([key] + file_stamp(bib_path))
+        manifest = {'filters': filters, 'entries': entries}
+
+        manifest_path = self._manifest_path(path)
+        if incremental:
+            try:
+                with open(manifest_path) as f:
+                    old_manifest = json.load(f)
+            except (OSError, ValueError):
+                old_manifest = None
+            if old_manifest == dict(manifest, output=file_stamp(path)):
+                return None
+
+        with AtomicFile(path) as f:
+            for i, key in enumerate(keys):
+                if i > 0:
+                    f.write('\n\n')
+                doc = ArchivalDocument(key,
+                                       DocumentPaths(self.archive_path, key))
+                f.write(doc.bibtex_str)
+
+        # The manifest is only needed to skip unnecessary work, so failing to
+        # write it is not fatal.
+        manifest['output'] = file_stamp(path)
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            write_atomic(manifest_path, json.dumps(manifest))
+        except OSError:
+            pass
+        return len(keys)
+
+    def export_pdfs(self, directory, link=None, threads=None, progress=None,
+                    **filters):
+        ''' Export the PDFs of the documents matching the filters, which are
+            those of search_docs, to a single directory, using a pool of
+            threads. PDFs already exported and unchanged since are skipped.
+            Params:
+                directory - Directory to export to. Created if necessary.
+                link - None to copy the PDFs (as reflinks where possible),
+                       or 'hard' or 'symbolic' to link to them instead.
+                threads - Size of the thread pool.
+                progress - Passed on to search_docs.
+            Returns:
+                A tuple (exported, skipped) of the number of PDFs that were
+                exported and the number that were already up to date. '''
+        os.makedirs(directory, exist_ok=True)
+        jobs = []
+        for doc, _ in self.search_docs(progress=progress, **filters):
+            pdf_path = doc.paths.pdf_path
+            jobs.append((pdf_path,
+                         os.path.join(directory, os.path.basename(pdf_path))))
+
+        def _export(job):
+            return export_file(job[0], job[1], link)
+
+        if len(jobs) <= 1 or threads == 1:
+            results = [_export(job) for job in jobs]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+                results = list(pool.map(_export, jobs))
+        exported = sum(results)
+        return exported, len(results) - exported
+
+    def write_index(self, directory=None):
+        ''' Write a static HTML index of every document, by default to the
+            index directory of the library. Only files that have changed since
+            the index was last written are rewritten. Returns a tuple
+            (written, total) of the number of files written and the total
+            number of files in the index. '''
+        if directory is None:
+            directory = os.path.join(self.path, 'index')
+        return htmlindex.write_index(self.all_docs(), directory)
+
+    def _index_text(self, doc, pdf_hash, text):
+        ''' Add the text of a document to the full-text index, if possible. '''
+        try:
+            self.text_index.update(doc.key, pdf_hash, text)
+        except (OSError, sqlite3.Error):
+            pass
+
+    def extract_text(self, docs=None, processes=None, progress=None,
+                     verify=False, retry_failed=False):
+        ''' Extract the text of every document whose cached text is stale,
+            using a pool of processes, and add it to the full-text index.
+            Params:
+                docs - Documents to consider. Defaults to all documents.
+                processes - Size of the process pool. Defaults to the
+                            'processes' config option, or one per CPU.
+                progress - Optional function called as
+                           progress(done, total) as each document finishes.
+                verify - Hash every PDF to check for changes, rather than
+                         trusting unchanged file sizes and modification times.
+                retry_failed - Retry documents whose text previously failed
+                               to be extracted, even if they haven't changed.
+            Returns:
+                A tuple (extracted, failed) of the number of documents whose
+                text was extracted and the number that failed. '''
+        if docs is None:
+            docs = self.all_docs()
+
+        stale = stale_docs(docs, verify, retry_failed)
+        if stale and processes is None:
+            processes = self.processes
+        done = 0
+        failed = 0
+        for doc, pdf_hash, text, failure in extract_texts(stale, processes):
+            self._index_text(doc, pdf_hash, text)
+            done += 1
+            if failure:
+                failed += 1
+            if progress:
+                progress(done, len(stale))
+        return done - failed, failed
+
+    def _refresh_text(self, docs, progress=None):
+        ''' Bring the cached text of the documents and their entries in the
+            full-text index up to date. Returns False if the index can't be
+            used. '''
+        self.extract_text(docs, progress=progress)
+
+        try:
+            digests = self.text_index.digests()
+        except (OSError, sqlite3.Error):
+            return False
+
+        # Index any text that was extracted before the index existed.
+        for doc in docs:
+            digest = doc.cached_hash()
+            if digests.get(doc.key) != digest:
+                self.text_index.update(doc.key, digest, doc.cached_text())
+        return True
+
+    def _search_text(self, tmpl, docs, progress=None):
+        ''' Match the documents against the text pattern of the template,
+            using the full-text index where possible. Yields (document, count)
+            tuples for the matching documents. '''
+        # Without an index, scan the text of every document.
+        if not self._refresh_text(docs, progress):
+            for doc in docs:
+                result, count = doc.matches(tmpl)
+                if result:
+                    yield doc, count
+            return
+
+        counts, exact = self.text_index.search(tmpl.text_regex,
+                                               [doc.key for doc in docs])
+        for doc in docs:
+            if doc.key not in counts:
+                continue
+            if exact:
+                count = counts[doc.key]
+            else:
+                # The index could only narrow down the candidates, so the
+                # remaining ones are checked against their actual text.
+                _, count = tmpl.text(doc.cached_text)
+            if count > 0:
+                yield doc, count
+
+    def _scan_keys(self, tmpl):
+        ''' Yield the keys in the archive that match the key filter of the
+            template, straight from the directory listing. '''
+        with os.scandir(self.archive_path) as entries:
+            for entry in entries:
+                if entry.is_dir() and tmpl.key(entry.name):
+                    yield entry.name
+
+    def _documents(self, keys):
+        ''' Yield the documents with the given keys, with their metadata
+            filled in from the catalog where it is up to date. '''
+        docs = (ArchivalDocument(key, DocumentPaths(self.archive_path, key))
+                for key in keys)
+        return self.catalog.fill(docs)
+
+    def _match_metadata(self, tmpl):
+        ''' Yield the documents that match every field of the template but
+            the text pattern. Filters are applied in order of cost, with each
+            stage only seeing the documents that survived the previous ones:
+            keys only need the directory listing, tags only the tag index,
+            the date opened only the date log, and the remaining fields the
+            catalog or bibtex file. '''
+        keys = self._scan_keys(tmpl)
+        if tmpl.tag_list:
+            tagged = self.tag_index.keys_with(tmpl.tag_list)
+            keys = (key for key in keys if key in tagged)
+        if tmpl.opened_days is not None:
+            opened = self._opened_keys(tmpl.opened_days)
+            keys = (key for key in keys if key in opened)
+        return (doc for doc in self._documents(keys)
+                if doc.matches_metadata(tmpl))
 
     def search_docs(self, key=None, title=None, author=None, year=None,
                     venue=None, entrytype=None, text=None, tags=None,
-                    sort=None, reverse=False):
-        ''' Search documents for those that match the provided filters and
-            produce a summary of the results. '''
+                    opened=None, query=None, sort=None, reverse=False,
+                    limit=None, progress=None):
+        ''' Search documents for those that match the provided filters, and
+            the query (see query.parse) if one is given. opened is a number
+            of days: if it is given, only documents opened within that many
+            days match.
+            Yields (document, count) tuples, where count is the number of
+            matches of the text pattern. At most limit results are produced.
+            Unsorted results are yielded as soon as they are found; when
+            sorting with a limit, only the best limit results are kept in
+            memory. progress is passed on to extract_text if any text needs
+            to be extracted. The dates of the documents are only read from the
+            date log when sorting by them. '''
         # Find documents matching the criteria.
         tmpl = DocumentTemplate(key, title, author, year, venue, entrytype,
-                                text, tags)
-        docs = []
-        counts = []
-        for doc in self.all_docs():
-            result, count = doc.matches(tmpl)
-            if result:
-                docs.append(doc)
-                counts.append(count)
+                                text, tags, opened)
+        if query:
+            # The filters are just more terms of the query.
+            filters = [Term(field, pattern) for field, pattern in (
+                           ('key', key), ('title', title), ('author', author),
+                           ('year', year), ('venue', venue),
+                           ('type', entrytype), ('text', text),
+                           ('tags', tags)) if pattern]
+            if opened is not None:
+                filters.append(Term('opened', opened))
+            node = And(filters + [parse_query(query)])
+            results = Query(self, node, progress).results()
+        elif tmpl.text_regex:
+            # The text pattern is the most expensive filter, so it only sees
+            # the documents that match everything else.
+            docs = list(self._match_metadata(tmpl))
+            results = self._search_text(tmpl, docs, progress)
+        else:
+            results = ((doc, 0) for doc in self._match_metadata(tmpl))
+        if sort in DATE_SORTS:
+            results = self._with_dates(results)
+
+        if not sort:
+            yield from itertools.islice(results, limit)
+            return
 
         # Sort the matching documents.
-        if sort:
-            def _doc_sort_key(doc_count_tuple):
-                doc, count = doc_count_tuple
-
-                if sort == 'key':
-                    return doc.key
-                if sort == 'title':
-                    return doc.bibtex['title'].lower()
-                if sort == 'year':
-                    return doc.bibtex['year']
-                if sort == 'added':
-                    return doc.added_date
-                if sort == 'accessed':
-                    return doc.accessed_date
-                if sort == 'matches':
-                    return count
-                return doc.bibtex['year']
-
-            if sort not in ['key', 'title']:
-                reverse = not reverse
-            docs_counts = sorted(zip(docs, counts), key=_doc_sort_key,
-                                 reverse=reverse)
-            docs, counts = tuple(zip(*docs_counts))
-
-        return zip(docs, counts)
+        sort_key = _sort_key(sort)
+        if sort not in ['key', 'title']:
+            reverse = not reverse
+        if limit is None:
+            yield from sorted(results, key=sort_key, reverse=reverse)
+        elif reverse:
+            yield from heapq.nlargest(limit, results, key=sort_key)
+        else:
+            yield from heapq.nsmallest(limit, results, key=sort_key)
@@ -0,0 +1,289 @@
+import re
+
+from .document import DocumentTemplate
+from .exceptions import LibraryException
+
+
+# Relative cost of evaluating a term of each field: keys only need the
+# directory listing, tags the tag index, the date opened the date log, other
+# metadata the catalog or bibtex file, and text the text index or the text
+# itself.
+KEY_COST = 0
+TAG_COST = 1
+METADATA_COST = 2
+TEXT_COST = 3
+
+# Field name in a query => (keyword argument of DocumentTemplate, cost).
+FIELDS = {
+    'key': ('key_pattern', KEY_COST),
+    'tag': ('tag_pattern', TAG_COST),
+    'tags': ('tag_pattern', TAG_COST),
+    'opened': ('opened_pattern', TAG_COST),
+    'title': ('title_pattern', METADATA_COST),
+    'author': ('author_pattern', METADATA_COST),
+    'year': ('year_pattern', METADATA_COST),
+    'venue': ('venue_pattern', METADATA_COST),
+    'type': ('entrytype_pattern', METADATA_COST),
+    'text': ('text_pattern', TEXT_COST),
+}
+
+_TOKEN_REGEX = re.compile(r'''
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<field>\w+):(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s()"]+))
+      | (?P<word>[^\s()]+)
+    )''', re.VERBOSE)
+
+class Term(object):
+    ''' A single field:pattern term of a query, which matches documents the
+        same way as the corresponding filter option. '''
+    def __init__(self, field, pattern):
+        if field not in FIELDS:
+            msg = 'Unknown field {} in query. Fields are: {}.'.format(
+                    field, ', '.join(sorted(FIELDS)))
+            raise LibraryException(msg)
+        arg, self.cost = FIELDS[field]
+        self.field = field
+        self.pattern = pattern
+        try:
+            self.tmpl = DocumentTemplate(**{arg: pattern})
+        except (re.error, ValueError, IndexError) as e:
+            msg = 'Invalid pattern {} for {}: {}'.format(pattern, field, e)
+            raise LibraryException(msg)
+
+    def __repr__(self):
+        return '{}:{}'.format(self.field, self.pattern)
+
+    def evaluate(self, query, keys):
+        return query.match_term(self, keys)
+
+
+class Not(object):
+    def __init__(self, child):
+        self.child = child
+        self.cost = child.cost
+
+    def __repr__(self):
+        return 'NOT {!r}'.format(self.child)
+
+    def evaluate(self, query, keys):
+        return keys.difference(self.child.evaluate(query, keys))
+
+
+class And(object):
+    def __init__(self, children):
+        self.children = children
+        self.cost = max(child.cost for child in children)
+
+    def __repr__(self):
+        return '({})'.format(' AND '.join(repr(c) for c in self.children))
+
+    def evaluate(self, query, keys):
+        # Each term only sees the documents that all of the cheaper ones
+        # matched, so the expensive terms are evaluated as rarely as possible.
+        for child in query.plan(self.children):
+            if not keys:
+                break
+            keys = child.evaluate(query, keys)
+        return keys
+
+
+class Or(object):
+    def __init__(self, children):
+        self.children = children
+        self.cost = max(child.cost for child in children)
+
+    def __repr__(self):
+        return '({})'.format(' OR '.join(repr(c) for c in self.children))
+
+    def evaluate(self, query, keys):
+        # Documents that one term has matched needn't be checked against the
+        # rest, except by text terms, so that all of their matches are
+        # counted.
+        matched = set()
+        for child in query.plan(self.children):
+            if child.cost == TEXT_COST:
+                matched.update(child.evaluate(query, keys))
+                continue
+            remaining = keys.difference(matched)
+            if not remaining:
+                break
+            matched.update(child.evaluate(query, remaining))
+        return matched
+
+
+class _Parser(object):
+    ''' Recursive descent parser for queries, with the grammar:
+            or   := and ('OR' and)*
+            and  := not ('AND'? not)*
+            not  := 'NOT' not | atom
+            atom := '(' or ')' | field:pattern '''
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_REGEX.match(text, pos)
+            if match is None:
+                self.error('Unexpected character', pos)
+            start = pos + len(match.group()) - len(match.group().lstrip())
+            self.tokens.append((match, start))
+            pos = match.end()
+        self.index = 0
+
+    def error(self, message, pos=None):
+        if pos is None:
+            pos = len(self.text)
+        msg = '{} at position {} of query: {}'.format(message, pos + 1,
+                                                       self.text)
+        raise LibraryException(msg)
+
+    def peek(self):
+        ''' Return the next token as a tuple (kind, value), where kind is
+            the name of the group that matched, or None at the end. '''
+        if self.index == len(self.tokens):
+            return None, None
+        match, _ = self.tokens[self.index]
+        kind = match.lastgroup
+        if kind in ('quoted', 'value'):
+            kind = 'field'
+        return kind, match.group(kind)
+
+    def next(self):
+        self.index += 1
+
+    def position(self):
+        if self.index == len(self.tokens):
+            return None
+        return self.tokens[self.index][1]
+
+    def operator(self, name):
+        kind, value = self.peek()
+        return kind == 'word' and value.upper() == name
+
+    def parse(self):
+        if not self.tokens:
+            self.error('Empty query')
+        node = self.parse_or()
+        if self.index < len(self.tokens):
+            self.error('Unexpected token', self.position())
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.operator('OR'):
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while True:
+            if self.operator('AND'):
+                self.next()
+            elif self.peek()[0] is None or self.peek()[1] == ')' \
+                    or self.operator('OR'):
+                break
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.operator('NOT'):
+            self.next()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        pos = self.position()
+        if kind is None:
+            self.error('Unexpected end')
+        if value == '(':
+            self.next()
+            node = self.parse_or()
+            if self.peek()[1] != ')':
+                self.error('Expected )', self.position())
+            self.next()
+            return node
+        if kind != 'field':
+            self.error('Expected a field:pattern term', pos)
+        match, _ = self.tokens[self.index]
+        self.next()
+        pattern = match.group('quoted')
+        if pattern is None:
+            pattern = match.group('value')
+        return Term(match.group('field'), pattern)
+
+
+def parse(text):
+    ''' Parse a query such as
+            author:smith AND (year:2015-2020 OR tag:robotics) NOT venue:arxiv
+        into a tree of Term, Not, And and Or nodes. Terms next to each other
+        are implicitly ANDed, and patterns containing spaces may be quoted. '''
+    return _Parser(text).parse()
+
+
+class Query(object):
+    ''' Evaluation of a parsed query against a library. Documents are only
+        loaded for the keys that reach a term that needs them, and each is
+        loaded at most once. '''
+    def __init__(self, manager, node, progress=None):
+        self.manager = manager
+        self.node = node
+        self.progress = progress
+        self.docs = {}
+        self.counts = {}
+        self._tagged = {}
+
+    def _tagged_keys(self, term):
+        if term.pattern not in self._tagged:
+            self._tagged[term.pattern] = self.manager.tag_index.keys_with(
+                    term.tmpl.tag_list)
+        return self._tagged[term.pattern]
+
+    def plan(self, nodes):
+        ''' Order nodes for evaluation: cheapest first and, among those of
+            the same cost, the most selective first, as far as that is known
+            without evaluating them. '''
+        def _plan_key(node):
+            if isinstance(node, Term) and node.tmpl.tag_list:
+                return node.cost, len(self._tagged_keys(node))
+            return node.cost, float('inf')
+        return sorted(nodes, key=_plan_key)
+
+    def _documents(self, keys):
+        missing = [key for key in keys if key not in self.docs]
+        for doc in self.manager._documents(missing):
+            self.docs[doc.key] = doc
+        return [self.docs[key] for key in keys]
+
+    def match_term(self, term, keys):
+        ''' Return the subset of the set of keys that match a term. '''
+        if term.cost == KEY_COST:
+            return {key for key in keys if term.tmpl.key(key)}
+        if term.tmpl.opened_days is not None:
+            return keys.intersection(
+                    self.manager._opened_keys(term.tmpl.opened_days))
+        if term.cost == TAG_COST:
+            return keys.intersection(self._tagged_keys(term))
+        docs = self._documents(sorted(keys))
+        if term.cost == METADATA_COST:
+            return {doc.key for doc in docs if doc.matches_metadata(term.tmpl)}
+
+        matched = set()
+        for doc, count in self.manager._search_text(term.tmpl, docs,
+                                                    self.progress):
+            self.counts[doc.key] = self.counts.get(doc.key, 0) + count
+            matched.add(doc.key)
+        return matched
+
+    def results(self):
+        ''' Yield (document, count) tuples for the matching documents, in the
+            order of the archive, where count is the total number of matches
+            of the text terms. '''
+        keys = list(self.manager._scan_keys(DocumentTemplate()))
+        matched = self.node.evaluate(self, set(keys))
+        keys = [key for key in keys if key in matched]
+        for doc in self._documents(keys):
+            yield doc, self.counts.get(doc.key, 0)
@@ -0,0 +1,107 @@
+import json
+import os
+import re
+
+from .document import DocumentPaths
+from .exceptions import LibraryException
+from .fileops import write_atomic
+
+
+def set_bibtex_key(text, old_key, new_key, bibtex_key=None):
+    ''' Change the key of the entry in the contents of a bibtex file, leaving
+        the rest of the file exactly as it was. If the entry already has the
+        new key, the text is returned unchanged. bibtex_key is the key the
+        entry actually has, if it differs from old_key. '''
+    keys = [old_key, new_key]
+    if bibtex_key is not None and bibtex_key not in keys:
+        keys.append(bibtex_key)
+    for key in keys:
+        regex = re.compile(r'(@\s*\w+\s*[{(]\s*)' + re.escape(key) + r'(\s*,)')
+        if regex.search(text):
+            return regex.sub(lambda m: m.group(1) + new_key + m.group(2),
+                             text, count=1)
+    raise LibraryException('Could not find key {} in its bibtex file.'.format(
+        old_key))
+
+
+def _move(src, dest):
+    ''' Rename src to dest, unless that has already been done. '''
+    if os.path.lexists(src) and not os.path.lexists(dest):
+        os.rename(src, dest)
+
+
+class RekeyJournal(object):
+    ''' Journal of a batch of documents being rekeyed, so that the batch is
+        either completed or undone if we're interrupted partway.
+
+        Each document is renamed in three steps, none of which removes
+        anything: the bibtex file with the new key is written beside the old
+        one, the PDF is renamed, and then the document's directory is
+        renamed. Once every document has been renamed, the journal is marked
+        as committed, and only then are the old bibtex files removed. So
+        until the commit, any document can be put back the way it was, and
+        after it, finishing the batch only involves steps that are safe to
+        repeat. '''
+    def __init__(self, path, archive_path):
+        self.path = path
+        self.archive_path = archive_path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        ''' Returns a tuple (renames, committed), where renames is a list of
+            (old_key, new_key) pairs, or None if there is no journal. '''
+        try:
+            with open(self.path) as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return None
+        renames = [tuple(pair) for pair in journal['renames']]
+        return renames, journal['committed']
+
+    def _write(self, renames, committed):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps({'renames': renames,
+                                            'committed': committed}))
+
+    def begin(self, renames):
+        self._write(renames, False)
+
+    def commit(self, renames):
+        self._write(renames, True)
+
+    def remove(self):
+        os.remove(self.path)
+
+    def rename(self, old_key, new_key, bibtex_str):
+        ''' Rename a single document, writing its bibtex with the new key. '''
+        old_paths = DocumentPaths(self.archive_path, old_key)
+        new_bib_path = os.path.join(old_paths.key_path, new_key + '.bib')
+        write_atomic(new_bib_path, bibtex_str)
+        _move(old_paths.pdf_path,
+              os.path.join(old_paths.key_path, new_key + '.pdf'))
+        _move(old_paths.key_path,
+              DocumentPaths(self.archive_path, new_key).key_path)
+
+    def rollback(self, renames):
+        ''' Undo the renames, as far as they got. '''
+        for old_key, new_key in reversed(renames):
+            old_paths = DocumentPaths(self.archive_path, old_key)
+            _move(DocumentPaths(self.archive_path, new_key).key_path,
+                  old_paths.key_path)
+            _move(os.path.join(old_paths.key_path, new_key + '.pdf'),
+                  old_paths.pdf_path)
+            new_bib_path = os.path.join(old_paths.key_path, new_key + '.bib')
+            if os.path.exists(new_bib_path) and os.path.exists(
+                    old_paths.bib_path):
+                os.remove(new_bib_path)
+
+    def clean_up(self, renames):
+        ''' Remove the old bibtex files of committed renames. '''
+        for old_key, new_key in renames:
+            new_paths = DocumentPaths(self.archive_path, new_key)
+            old_bib_path = os.path.join(new_paths.key_path, old_key + '.bib')
+            if os.path.exists(old_bib_path) and os.path.exists(
+                    new_paths.bib_path):
+                os.remove(old_bib_path)
@@ -1,15 +1,15 @@
 import sys
 
-import colorama
-
 
 def yellow(s):
     if sys.stdout.isatty():
+        import colorama
         return colorama.Fore.YELLOW + s + colorama.Fore.RESET
     return s
 
 
 def bold(s):
     if sys.stdout.isatty():
+        import colorama
         return colorama.Style.BRIGHT + s + colorama.Style.RESET_ALL
     return s
@@ -0,0 +1,148 @@
+import json
+import os
+
+from .document import DocumentPaths, ArchivalDocument
+from .fileops import file_stamp, write_atomic
+
+
+class TagIndex(object):
+    ''' Index of the tags applied to every document in the archive, stored as
+        a single JSON file mapping each key to the stamp and contents of its
+        tags.txt. Entries whose tags.txt has changed are re-read when the index
+        is loaded, so the index never needs to be rebuilt from scratch. '''
+    def __init__(self, path, archive_path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.archive_path = archive_path
+        self._entries = None
+
+    def _read(self):
+        ''' Read the raw index from disk. '''
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self):
+        ''' Write the index to disk. The index is only a cache, so failure to
+            write it is ignored. '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(self._entries))
+        except OSError:
+            pass
+
+    def load(self):
+        ''' Return a dictionary mapping every key in the archive to its list of
+            tags, bringing the index up to date with the tag files first. '''
+        if self._entries is not None:
+            return {key: entry[2] for key, entry in self._entries.items()}
+
+        self._finish_rename()
+
+        cached = self._read()
+        entries = {}
+        changed = False
+        with os.scandir(self.archive_path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                key = entry.name
+                paths = DocumentPaths(self.archive_path, key)
+                stamp = file_stamp(paths.tag_path)
+                if key in cached and cached[key][:2] == stamp:
+                    entries[key] = cached[key]
+                else:
+                    tags = ArchivalDocument(key, paths).tags
+                    entries[key] = stamp + [tags]
+                    changed = True
+
+        self._entries = entries
+        if changed or len(entries) != len(cached):
+            self._write()
+        return {key: entry[2] for key, entry in entries.items()}
+
+    def keys_with(self, tags):
+        ''' Return the set of keys of documents that have all of the given
+            tags. '''
+        tag_map = self.tag_map()
+        keys = None
+        for tag in tags:
+            tagged = tag_map.get(tag, set())
+            keys = tagged if keys is None else keys.intersection(tagged)
+        return keys if keys is not None else set(self.load().keys())
+
+    def tag_map(self):
+        ''' Return a dictionary mapping each tag to the set of keys of the
+            documents it is applied to. '''
+        tag_map = {}
+        for key, tags in self.load().items():
+            for tag in tags:
+                tag_map.setdefault(tag, set()).add(key)
+        return tag_map
+
+    def update(self, doc):
+        ''' Record the current tags of a document, after they have been
+            saved. '''
+        self.load()
+        self._entries[doc.key] = file_stamp(doc.paths.tag_path) + [doc.tags]
+        self._write()
+
+    def refresh(self, keys):
+        ''' Re-read the tags of the documents with the given keys, dropping
+            those that are no longer in the archive. '''
+        self.load()
+        for key in keys:
+            paths = DocumentPaths(self.archive_path, key)
+            if os.path.isdir(paths.key_path):
+                tags = ArchivalDocument(key, paths).tags
+                self._entries[key] = file_stamp(paths.tag_path) + [tags]
+            else:
+                self._entries.pop(key, None)
+        self._write()
+
+    def rename_keys(self, renames):
+        ''' Move the entries of rekeyed documents, given as (old_key, new_key)
+            pairs, to their new keys. Their tag files are unchanged. '''
+        if self._entries is None:
+            self._entries = self._read()
+        for old_key, new_key in renames:
+            if old_key in self._entries:
+                self._entries[new_key] = self._entries.pop(old_key)
+        self._write()
+
+    def rename(self, current_tag, new_tag):
+        ''' Rename a tag across all documents as a single operation. The keys
+            to change are written to a journal first, so that if we're
+            interrupted the rename is completed the next time the index is
+            loaded, rather than being left half done. '''
+        keys = sorted(self.tag_map().get(current_tag, []))
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        write_atomic(self.journal_path, json.dumps([current_tag, new_tag,
+                                                    keys]))
+        self._finish_rename()
+
+    def _finish_rename(self):
+        ''' Apply the rename recorded in the journal, if there is one. Renaming
+            is idempotent, so it is safe to repeat for documents that were
+            already done. '''
+        try:
+            with open(self.journal_path) as f:
+                current_tag, new_tag, keys = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if self._entries is None:
+            self._entries = self._read()
+        for key in keys:
+            paths = DocumentPaths(self.archive_path, key)
+            if not os.path.isdir(paths.key_path):
+                continue
+            doc = ArchivalDocument(key, paths)
+            doc.rename_tag(current_tag, new_tag)
+            self._entries[key] = file_stamp(paths.tag_path) + [doc.tags]
+        self._write()
+        os.remove(self.journal_path)
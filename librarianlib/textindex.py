@@ -0,0 +1,242 @@
+import array
+import os
+import re
+import sqlite3
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+INDEX_VERSION = 1
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (term_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_key ON postings (key);
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+'''
+
+# Terms are maximal runs of word characters. A regex made up only of word
+# characters can never match across a term boundary, which is what lets us
+# answer such queries from the index alone.
+TERM_REGEX = re.compile(r'\w+')
+WORD_PATTERN_REGEX = re.compile(r'\w+')
+PHRASE_PATTERN_REGEX = re.compile(r'\w+( \w+)+')
+
+
+def _tokenize(text):
+    ''' Map each term in the text to an array of the positions (term ordinals)
+        at which it occurs. '''
+    terms = {}
+    for position, match in enumerate(TERM_REGEX.finditer(text)):
+        term = match.group()
+        if term not in terms:
+            terms[term] = array.array('I')
+        terms[term].append(position)
+    return terms
+
+
+def _required_literal(regex):
+    ''' Find the longest run of word characters that every match of the regex
+        must contain, or None if no such run can be determined. '''
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return None
+
+    runs = []
+
+    def _walk(items):
+        run = ''
+        for op, av in items:
+            if op == sre_parse.LITERAL and TERM_REGEX.fullmatch(chr(av)):
+                run += chr(av)
+                continue
+            runs.append(run)
+            run = ''
+            # Plain groups must match in full, so their contents are
+            # required too.
+            if op == sre_parse.SUBPATTERN:
+                _walk(av[-1])
+        runs.append(run)
+
+    _walk(parsed)
+    literal = max(runs, key=len)
+    return literal if literal else None
+
+
+class TextIndex(object):
+    ''' Persistent inverted index over the extracted text of the documents in
+        the archive, stored as an SQLite database. Each document is indexed
+        along with the digest of the PDF its text was extracted from, so that
+        stale entries can be detected. '''
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connection(self):
+        ''' Open the index database, (re)creating it if it is missing or out of
+            date. Raises sqlite3.Error or OSError if the index is unusable. '''
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != INDEX_VERSION:
+                with conn:
+                    for table in ('terms', 'postings', 'documents'):
+                        conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+                    conn.execute('PRAGMA user_version = {}'.format(
+                        INDEX_VERSION))
+            conn.executescript(INDEX_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def digests(self):
+        ''' Return a dictionary mapping each indexed key to the digest of the
+            PDF it was indexed from. '''
+        conn = self._connection()
+        return dict(conn.execute('SELECT key, digest FROM documents'))
+
+    def update(self, key, digest, text):
+        ''' (Re)index the text of a document. text may be None if the text
+            could not be extracted, in which case the document is recorded as
+            having no terms. '''
+        conn = self._connection()
+        terms = _tokenize(text) if text else {}
+        with conn:
+            conn.execute('DELETE FROM postings WHERE key = ?', (key,))
+            conn.executemany('INSERT OR IGNORE INTO terms (term) VALUES (?)',
+                             [(term,) for term in terms])
+            rows = []
+            for term, positions in terms.items():
+                term_id = conn.execute('SELECT id FROM terms WHERE term = ?',
+                                       (term,)).fetchone()[0]
+                rows.append((term_id, key, len(positions),
+                             positions.tobytes()))
+            conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO documents VALUES (?, ?)',
+                         (key, digest))
+
+    def remove(self, keys):
+        ''' Remove documents from the index. '''
+        conn = self._connection()
+        with conn:
+            for key in keys:
+                conn.execute('DELETE FROM postings WHERE key = ?', (key,))
+                conn.execute('DELETE FROM documents WHERE key = ?', (key,))
+
+    def rename_keys(self, renames):
+        ''' Move the entries of rekeyed documents, given as (old_key, new_key)
+            pairs, to their new keys. '''
+        conn = self._connection()
+        with conn:
+            for old_key, new_key in renames:
+                conn.execute('UPDATE postings SET key = ? WHERE key = ?',
+                             (new_key, old_key))
+                conn.execute('UPDATE documents SET key = ? WHERE key = ?',
+                             (new_key, old_key))
+
+    def _matching_terms(self, regex):
+        ''' Return the (id, term) pairs of all terms the regex matches. '''
+        conn = self._connection()
+        return [(term_id, term) for term_id, term
+                in conn.execute('SELECT id, term FROM terms')
+                if regex.search(term)]
+
+    def _postings(self, term_ids, keys):
+        ''' Yield (key, count, positions) for the postings of the terms,
+            restricted to the given keys. '''
+        conn = self._connection()
+        for term_id in term_ids:
+            cursor = conn.execute(
+                    'SELECT key, count, positions FROM postings '
+                    'WHERE term_id = ?', (term_id,))
+            for key, count, positions in cursor:
+                if key in keys:
+                    yield key, count, positions
+
+    def _count_word(self, regex, keys):
+        ''' Count the matches of a regex consisting only of word characters in
+            each document. Such a regex only ever matches within a single term,
+            so the count in a document is the sum of the counts within each of
+            its terms. '''
+        counts = {}
+        for term_id, term in self._matching_terms(regex):
+            per_term = len(regex.findall(term))
+            for key, count, _ in self._postings([term_id], keys):
+                counts[key] = counts.get(key, 0) + per_term * count
+        return counts
+
+    def _phrase_candidates(self, words, keys):
+        ''' Find the documents in which terms that could match each of the
+            words of a phrase occur consecutively. '''
+        last = len(words) - 1
+        positions = []
+        for i, word in enumerate(words):
+            word = re.escape(word)
+            if i == 0:
+                pattern = word + '$'
+            elif i == last:
+                pattern = '^' + word
+            else:
+                pattern = '^' + word + '$'
+            regex = re.compile(pattern, re.IGNORECASE)
+            term_ids = [term_id for term_id, _ in self._matching_terms(regex)]
+            word_positions = {}
+            for key, _, blob in self._postings(term_ids, keys):
+                word_positions.setdefault(key, set()).update(
+                        array.array('I', blob))
+            positions.append(word_positions)
+            keys = keys.intersection(word_positions)
+
+        candidates = set()
+        for key in keys:
+            for start in positions[0][key]:
+                if all(start + i in positions[i][key]
+                       for i in range(1, len(words))):
+                    candidates.add(key)
+                    break
+        return candidates
+
+    def search(self, regex, keys):
+        ''' Search the indexed text of the documents with the given keys.
+            Returns a tuple (counts, exact). counts maps each key that may
+            match to its number of matches. If exact is False, the counts are
+            not known and the documents in counts are only candidates that
+            must still be checked against their text. '''
+        keys = set(keys)
+        pattern = regex.pattern
+
+        if WORD_PATTERN_REGEX.fullmatch(pattern):
+            return self._count_word(regex, keys), True
+
+        if PHRASE_PATTERN_REGEX.fullmatch(pattern):
+            candidates = self._phrase_candidates(pattern.split(' '), keys)
+        else:
+            literal = _required_literal(regex)
+            if literal is None:
+                candidates = keys
+            else:
+                literal_regex = re.compile(re.escape(literal), re.IGNORECASE)
+                candidates = self._count_word(literal_regex, keys).keys()
+
+        return dict.fromkeys(candidates, 0), False